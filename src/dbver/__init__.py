@@ -16,20 +16,38 @@ import collections.abc
 import contextlib
 import enum
 import functools
+import itertools
 import logging
+import math
+import os
+import re
 import sqlite3
+import sys
+import threading
+import time
+import traceback
 from typing import Any
 from typing import Callable
 from typing import cast
 from typing import ContextManager
 from typing import Dict
+from typing import Generator
 from typing import Generic
+from typing import Iterable
 from typing import Iterator
+from typing import List
 from typing import Mapping
+from typing import NamedTuple
+from typing import Optional
 from typing import Protocol
+from typing import Sequence
+from typing import Set
 from typing import Tuple
 from typing import Type
+from typing import TYPE_CHECKING
 from typing import TypeVar
+from typing import Union
+import weakref
 
 # Support goals:
 #  - sqlite, not an abstraction layer
@@ -88,14 +106,33 @@ from typing import TypeVar
 
 _LOG = logging.getLogger(__name__)
 
-Errors: Tuple[Type[Exception], ...] = (sqlite3.Error,)
 
-try:
-    import apsw
-except ImportError:
-    pass
-else:
-    Errors = (apsw.Error, *Errors)
+# To keep module import fast, modules only some functions need (apsw,
+# concurrent.futures, hashlib, heapq, json, pathlib, queue, urllib.parse) are
+# imported where they're used.
+
+
+def _errors() -> Tuple[Type[Exception], ...]:
+    # apsw errors can only happen if apsw was imported by someone else, so we
+    # don't pay to import it ourselves
+    apsw = sys.modules.get("apsw")
+    if apsw is None:
+        return (sqlite3.Error,)
+    return (apsw.Error, sqlite3.Error)
+
+
+if TYPE_CHECKING:
+    Errors: Tuple[Type[Exception], ...]
+
+
+def __getattr__(name: str) -> Any:
+    # Errors is computed on access, so it includes apsw.Error if apsw is
+    # imported after us. Unlike when dbver imported apsw itself, "from dbver
+    # import Errors" only sees apsw if it was already imported; use
+    # dbver.Errors to always get the current value.
+    if name == "Errors":
+        return _errors()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Cursor(Protocol):
@@ -118,6 +155,7 @@ class Connection(Protocol[_Cu_co]):
 
 
 _C = TypeVar("_C", bound=Connection)
+_T = TypeVar("_T")
 Factory = Callable[[], _C]
 Pool = Callable[[], ContextManager[_C]]
 
@@ -134,6 +172,599 @@ def null_pool(factory: Factory[_C]) -> Pool[_C]:
     return func
 
 
+class PoolStats(NamedTuple):
+    checkouts: int
+    creations: int
+    waits: int
+    wait_time: float
+    idle: int
+    busy: int
+
+
+class _Entry(Generic[_C]):
+    def __init__(self, conn: _C, generation: int) -> None:
+        self.conn = conn
+        self.generation = generation
+        self.pid = os.getpid()
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class ReusePool(Generic[_C]):
+    # A pool which reuses connections. Idle connections are reused most
+    # recently used first, so the least recently used ones age out under
+    # idle_timeout, down to min_size. Connections older than max_lifetime are
+    # closed when next idle. With max_size, callers wait for a connection to
+    # be returned.
+    #
+    # Timeouts are enforced whenever connections are checked out or returned,
+    # or by calling evict().
+    #
+    # warmup (see warmup()) is called on each new connection before it's
+    # used. With prefill, that many connections are created in the
+    # background; ready is set when they're done. As they're created on other
+    # threads, sqlite3 factories need check_same_thread=False, else prefilled
+    # connections are discarded with an error logged.
+    def __init__(
+        self,
+        factory: Factory[_C],
+        *,
+        max_size: int = None,
+        min_size: int = 0,
+        idle_timeout: float = None,
+        max_lifetime: float = None,
+        warmup: Callable[[_C], Any] = None,
+        prefill: int = 0,
+    ) -> None:
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be positive")
+        self._factory = factory
+        self._warmup = warmup
+        self._max_size = max_size
+        self._min_size = min_size
+        self._idle_timeout = idle_timeout
+        self._max_lifetime = max_lifetime
+        self._cond = threading.Condition()
+        # least recently used first
+        self._idle: List[_Entry[_C]] = []
+        self._busy = 0
+        self._generation = 0
+        self._checkouts = 0
+        self._creations = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._pid = os.getpid()
+        _POOLS.add(self)
+        self.ready = self.prefill(prefill)
+
+    def __call__(self) -> ContextManager[_C]:
+        return self._checkout()
+
+    def after_fork(self) -> None:
+        # Resets the pool in a child process. This is called automatically
+        # where os.register_at_fork() is available, and otherwise on next use.
+        #
+        # sqlite connections must not be used across fork()
+        # (https://sqlite.org/howtocorrupt.html#fork), and even closing one
+        # may affect the parent's locks or wal, so connections inherited from
+        # the parent are abandoned without being closed.
+        if self._pid == os.getpid():
+            return
+        _INHERITED.extend(entry.conn for entry in self._idle)
+        self._cond = threading.Condition()
+        self._idle = []
+        self._busy = 0
+        self._checkouts = 0
+        self._creations = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def _checkout(self) -> Iterator[_C]:
+        entry = self._acquire()
+        try:
+            yield entry.conn
+        finally:
+            self._release(entry)
+
+    def _acquire(self) -> _Entry[_C]:
+        self.after_fork()
+        to_close = []
+        with self._cond:
+            self._checkouts += 1
+            waited = False
+            start = time.monotonic()
+            while True:
+                to_close.extend(self._pop_expired(time.monotonic()))
+                if self._idle:
+                    break
+                if self._max_size is None or self._busy < self._max_size:
+                    break
+                if not waited:
+                    self._waits += 1
+                    waited = True
+                self._cond.wait()
+            if waited:
+                self._wait_time += time.monotonic() - start
+            entry = self._idle.pop() if self._idle else None
+            self._busy += 1
+            if entry is None:
+                self._creations += 1
+            generation = self._generation
+        _close_all(to_close)
+        if entry is not None:
+            return entry
+        try:
+            conn = self._create()
+        except BaseException:
+            with self._cond:
+                self._busy -= 1
+                self._cond.notify()
+            raise
+        return _Entry(conn, generation)
+
+    def _create(self) -> _C:
+        conn = self._factory()
+        if self._warmup is not None:
+            try:
+                self._warmup(conn)
+            except BaseException:
+                conn.close()
+                raise
+        return conn
+
+    def prefill(self, count: int, *, max_workers: int = None) -> threading.Event:
+        # Creates up to count connections (fewer if that would exceed
+        # max_size) in parallel on background threads, and adds them to the
+        # idle set. Returns an event which is set when they are done. Failures
+        # are logged, including sqlite3 connections which can't be used from
+        # other threads (see check_same_thread).
+        self.after_fork()
+        done = threading.Event()
+        with self._cond:
+            if self._max_size is not None:
+                count = min(count, self._max_size - self._busy - len(self._idle))
+            count = max(count, 0)
+            # counted as busy until created, so max_size holds
+            self._busy += count
+            self._creations += count
+            generation = self._generation
+        if not count:
+            done.set()
+            return done
+
+        def discard() -> None:
+            with self._cond:
+                self._busy -= 1
+                self._cond.notify()
+
+        def create_one() -> Optional[_C]:
+            try:
+                return self._create()
+            except Exception:
+                _LOG.exception("error prefilling connection")
+                discard()
+                return None
+
+        def run() -> None:
+            import concurrent.futures
+
+            try:
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers or count,
+                    thread_name_prefix="dbver-prefill",
+                ) as executor:
+                    futures = [executor.submit(create_one) for _ in range(count)]
+                    for future in concurrent.futures.as_completed(futures):
+                        conn = future.result()
+                        if conn is None:
+                            continue
+                        if _is_thread_bound(conn):
+                            # can't be closed here; it's closed when collected
+                            _LOG.error(
+                                "error prefilling connection: sqlite3 "
+                                "connections need check_same_thread=False"
+                            )
+                            discard()
+                            continue
+                        self._release(_Entry(conn, generation))
+            finally:
+                done.set()
+
+        threading.Thread(target=run, name="dbver-prefill", daemon=True).start()
+        return done
+
+    def _release(self, entry: _Entry[_C]) -> None:
+        self.after_fork()
+        if entry.pid != os.getpid():
+            # checked out before fork()
+            _INHERITED.append(entry.conn)
+            return
+        now = time.monotonic()
+        to_close = []
+        with self._cond:
+            self._busy -= 1
+            if entry.generation != self._generation or (
+                self._max_lifetime is not None
+                and now - entry.created >= self._max_lifetime
+            ):
+                to_close.append(entry.conn)
+            else:
+                entry.last_used = now
+                self._idle.append(entry)
+            to_close.extend(self._pop_expired(now))
+            self._cond.notify()
+        _close_all(to_close)
+
+    def _pop_expired(self, now: float) -> List[_C]:
+        # Must hold self._cond
+        expired: List[_C] = []
+        keep: List[_Entry[_C]] = []
+        size = len(self._idle) + self._busy
+        for entry in self._idle:
+            if (
+                self._max_lifetime is not None
+                and now - entry.created >= self._max_lifetime
+            ) or (
+                self._idle_timeout is not None
+                and now - entry.last_used >= self._idle_timeout
+                and size > self._min_size
+            ):
+                expired.append(entry.conn)
+                size -= 1
+            else:
+                keep.append(entry)
+        self._idle = keep
+        return expired
+
+    def evict(self) -> None:
+        self.after_fork()
+        with self._cond:
+            to_close = self._pop_expired(time.monotonic())
+        _close_all(to_close)
+
+    def close_all(self) -> None:
+        # Closes idle connections now, and busy connections when they are
+        # returned. The pool remains usable.
+        self.after_fork()
+        with self._cond:
+            self._generation += 1
+            to_close = [entry.conn for entry in self._idle]
+            self._idle = []
+        _close_all(to_close)
+
+    def stats(self) -> PoolStats:
+        self.after_fork()
+        with self._cond:
+            return PoolStats(
+                checkouts=self._checkouts,
+                creations=self._creations,
+                waits=self._waits,
+                wait_time=self._wait_time,
+                idle=len(self._idle),
+                busy=self._busy,
+            )
+
+
+_POOLS: "weakref.WeakSet[ReusePool[Any]]" = weakref.WeakSet()
+# Connections inherited across fork() are kept referenced forever, so they are
+# never finalized
+_INHERITED: List[Any] = []
+
+
+def _after_fork_in_child() -> None:
+    for pool in list(_POOLS):
+        pool.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _is_thread_bound(conn: Any) -> bool:
+    # Whether conn is a sqlite3 connection created on another thread with
+    # check_same_thread=True
+    if not isinstance(conn, sqlite3.Connection):
+        return False
+    try:
+        conn.cursor()
+    except sqlite3.ProgrammingError:
+        return True
+    return False
+
+
+def _close_all(conns: Sequence[_C]) -> None:
+    for conn in conns:
+        try:
+            conn.close()
+        except _errors():
+            _LOG.exception("error closing connection ignored")
+
+
+Pragmas = Mapping[str, Union[int, str]]
+
+# Presets for pragma_factory(). These are starting points; applications with
+# more specific needs should build their own.
+READ_HEAVY_PRAGMAS: Pragmas = {
+    "journal_mode": "wal",
+    "mmap_size": 1 << 30,
+    "cache_size": -64000,
+    "temp_store": "memory",
+    "busy_timeout": 5000,
+}
+WRITE_HEAVY_PRAGMAS: Pragmas = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64000,
+    "busy_timeout": 5000,
+}
+# Trades durability for speed, for maintenance windows. synchronous can't
+# change within a transaction; use with upgrade_in_transaction()
+BULK_LOAD_PRAGMAS: Pragmas = {
+    "synchronous": "off",
+    "cache_size": -1000000,
+    "temp_store": "memory",
+    "busy_timeout": 5000,
+}
+
+
+# Pragmas which can't change (or silently don't) within a transaction
+_NON_TRANSACTIONAL_PRAGMAS = frozenset({"synchronous", "journal_mode", "foreign_keys"})
+
+
+def _format_pragma(name: str, value: Union[int, str], schema: Optional[str]) -> str:
+    # sqlite doesn't support schema or pragma values as bind parameters.
+    # we must do string-formatted sql, and check our inputs
+    if not isinstance(name, str) or not name.isidentifier():
+        raise ValueError(f"invalid pragma name: {name!r}")
+    if isinstance(value, int):
+        value = int(value)
+    elif not isinstance(value, str) or not value.replace("_", "").isalnum():
+        raise ValueError(f"invalid pragma value: {value!r}")
+    if schema is None:
+        return f"pragma {name} = {value}"
+    _check_schema(schema)
+    return f'pragma "{schema}".{name} = {value}'
+
+
+def apply_pragmas(conn: _C, pragmas: Pragmas, schema: str = None) -> None:
+    # Validate everything before changing anything
+    statements = [
+        _format_pragma(name, value, schema) for name, value in pragmas.items()
+    ]
+    cur = cast(Any, conn.cursor())
+    for sql in statements:
+        # Some pragmas return rows; consume them so no statement remains active
+        cur.execute(sql).fetchall()
+
+
+def _get_pragma(conn: _C, name: str, schema: Optional[str]) -> Optional[Any]:
+    prefix = "" if schema is None else f'"{schema}".'
+    rows = cast(Any, conn.cursor()).execute(f"pragma {prefix}{name}").fetchall()
+    return rows[0][0] if rows else None
+
+
+@contextlib.contextmanager
+def pragma_scope(
+    conn: _C, pragmas: Pragmas, schema: str = None, *, checkpoint: bool = False
+) -> Iterator[None]:
+    # Applies pragmas, and restores their previous values afterward, even on
+    # error. With checkpoint, a truncating wal checkpoint is done after
+    # restoring, so it uses the original synchronous setting.
+    #
+    # Some pragmas (synchronous, journal_mode) can't be changed within a
+    # transaction, and only take effect at commit time, so a pragma_scope for
+    # them should surround the transaction.
+    for name, value in pragmas.items():
+        _format_pragma(name, value, schema)
+    saved: Dict[str, Union[int, str]] = {}
+    for name in pragmas:
+        old = _get_pragma(conn, name, schema)
+        if old is not None:
+            saved[name] = old
+    try:
+        apply_pragmas(conn, pragmas, schema=schema)
+        yield
+    except BaseException:
+        try:
+            apply_pragmas(conn, saved, schema=schema)
+        except _errors():
+            _LOG.exception("error restoring pragmas ignored")
+        raise
+    else:
+        apply_pragmas(conn, saved, schema=schema)
+        if checkpoint:
+            cast(Any, conn.cursor()).execute(
+                "pragma wal_checkpoint(truncate)"
+            ).fetchall()
+
+
+def pragma_factory(factory: Factory[_C], pragmas: Pragmas) -> Factory[_C]:
+    # Applies pragmas once to each new connection. Pools which reuse
+    # connections thus apply them once per physical connection.
+    for name, value in pragmas.items():
+        _format_pragma(name, value, None)
+
+    def func() -> _C:
+        conn = factory()
+        try:
+            apply_pragmas(conn, pragmas)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    return func
+
+
+def warmup(
+    *,
+    pragmas: Pragmas = None,
+    migrations: "Migrations[Any, _C]" = None,
+    schema: str = "main",
+    tables: Sequence[str] = (),
+    indexes: Sequence[str] = (),
+) -> Callable[[_C], None]:
+    # A warmup hook for ReusePool: applies pragmas, runs migrations.check(),
+    # then reads tables and indexes in full, filling the connection's page
+    # cache (and the os cache) with them.
+    _check_schema(schema)
+    for name in itertools.chain(tables, indexes):
+        _check_name(name)
+
+    def func(conn: _C) -> None:
+        if pragmas:
+            apply_pragmas(conn, pragmas, schema=schema)
+        if migrations is not None:
+            migrations.check(conn, schema=schema)
+        cur = cast(Any, conn.cursor())
+        for table in tables:
+            for _ in cur.execute(f'select * from "{schema}"."{table}"'):
+                pass
+        for index in indexes:
+            ((table,),) = cur.execute(
+                f'select tbl_name from "{schema}".sqlite_master '
+                "where type = 'index' and name = ?",
+                (index,),
+            ).fetchall()
+            _check_name(table)
+            cur.execute(
+                f'select count(*) from "{schema}"."{table}" indexed by "{index}"'
+            ).fetchall()
+
+    return func
+
+
+def readonly_uri(path: str, *, immutable: bool = False) -> str:
+    # A uri filename (https://sqlite.org/uri.html) to open path read-only.
+    # immutable=True asserts the file will never change while open; sqlite
+    # then does no locking or change detection at all. Open with
+    # sqlite3.connect(uri, uri=True) or apsw.Connection(uri,
+    # flags=apsw.SQLITE_OPEN_READONLY | apsw.SQLITE_OPEN_URI).
+    import pathlib
+
+    uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    return uri
+
+
+def readonly_pool(
+    factory: Factory[_C],
+    *,
+    check: Callable[[_C], Any] = None,
+    mmap_size: int = 1 << 30,
+    max_size: int = None,
+    min_size: int = 0,
+    idle_timeout: float = None,
+    max_lifetime: float = None,
+    warmup: Callable[[_C], Any] = None,
+    prefill: int = 0,
+) -> ReusePool[_C]:
+    # A ReusePool for databases which are only read, such as those opened
+    # with readonly_uri(immutable=True). Connections are memory-mapped. check
+    # (for example, Migrations.get_format) is called only on the first
+    # connection created. Immutable databases need no transactions, so
+    # connections can be used directly instead of through begin_pool().
+    mmap_factory = pragma_factory(factory, {"mmap_size": mmap_size})
+    lock = threading.Lock()
+    checked = False
+
+    def func() -> _C:
+        nonlocal checked
+        conn = mmap_factory()
+        if check is None or checked:
+            return conn
+        try:
+            with lock:
+                if not checked:
+                    check(conn)
+                    checked = True
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    return ReusePool(
+        func,
+        max_size=max_size,
+        min_size=min_size,
+        idle_timeout=idle_timeout,
+        max_lifetime=max_lifetime,
+        warmup=warmup,
+        prefill=prefill,
+    )
+
+
+_MEMORY_NAMES = itertools.count()
+
+
+def memory_uri(name: str = None, *, shared_cache: bool = False) -> str:
+    # A uri filename for a named in-memory database, which all connections in
+    # the process opening the same uri share. By default this uses the memdb
+    # vfs (sqlite 3.36+), which has normal locking, so busy_timeout and
+    # concurrent transactions behave as they do for files (except wal isn't
+    # available). With shared_cache, it uses a shared-cache in-memory
+    # database instead, where lock conflicts fail at once with SQLITE_LOCKED
+    # (some builds, including apsw wheels, omit shared cache).
+    # A unique name is made if none is given. Open with
+    # sqlite3.connect(uri, uri=True) or apsw.Connection(uri,
+    # flags=apsw.SQLITE_OPEN_READWRITE | apsw.SQLITE_OPEN_CREATE |
+    # apsw.SQLITE_OPEN_URI).
+    import urllib.parse
+
+    if name is None:
+        name = f"dbver-{os.getpid()}-{next(_MEMORY_NAMES)}"
+    quoted = urllib.parse.quote(name, safe="")
+    if shared_cache:
+        return f"file:{quoted}?mode=memory&cache=shared"
+    return f"file:/{quoted}?vfs=memdb"
+
+
+class MemoryPool(ReusePool[_C]):
+    # A ReusePool for a named in-memory database, opened by factory with
+    # memory_uri(). An in-memory database is dropped when its last connection
+    # closes, so the pool keeps an anchor connection open until close().
+    # close_all() leaves the database intact.
+    def __init__(
+        self,
+        factory: Factory[_C],
+        *,
+        max_size: int = None,
+        min_size: int = 0,
+        idle_timeout: float = None,
+        max_lifetime: float = None,
+        warmup: Callable[[_C], Any] = None,
+        prefill: int = 0,
+    ) -> None:
+        super().__init__(
+            factory,
+            max_size=max_size,
+            min_size=min_size,
+            idle_timeout=idle_timeout,
+            max_lifetime=max_lifetime,
+            warmup=warmup,
+        )
+        # opened before prefill starts, so the database outlives any
+        # prefilled connection that's discarded
+        self._anchor: Optional[_C] = factory()
+        self.ready = self.prefill(prefill)
+
+    def close(self) -> None:
+        # Closes all connections and the anchor, dropping the database
+        self.close_all()
+        anchor, self._anchor = self._anchor, None
+        if anchor is not None:
+            _close_all([anchor])
+
+    def after_fork(self) -> None:
+        if self._pid != os.getpid() and self._anchor is not None:
+            _INHERITED.append(self._anchor)
+            self._anchor = None
+        super().after_fork()
+
+
 class LockMode(str, enum.Enum):
     IMMEDIATE = "immediate"
     DEFERRED = "deferred"
@@ -145,26 +776,37 @@ DEFERRED = LockMode.DEFERRED
 EXCLUSIVE = LockMode.EXCLUSIVE
 
 
+# The started TransactionWatchdog, if any
+_WATCHDOG: Optional["TransactionWatchdog"] = None
+_WATCHDOG_LOCK = threading.Lock()
+
+
 @contextlib.contextmanager
 def begin(conn: _C, lock_mode: LockMode) -> Iterator[None]:
     cur = conn.cursor()
     cur.execute(f"begin {lock_mode.value}")
+    watchdog = _WATCHDOG
+    token = watchdog._opened(conn, lock_mode) if watchdog is not None else 0
     try:
         yield
+        # A failed commit (such as SQLITE_BUSY) leaves the transaction open;
+        # roll it back like any other failure
+        cur.execute("commit")
     except Exception:
         # Per https://sqlite.org/lang_transaction.html : some errors may cause
         # an automatic rollback; we should always explicitly rollback and
         # ignore any errors.
         try:
             cur.execute("rollback")
-        except Errors:
+        except _errors():
             # Ideally we'd narrow this exception match
             _LOG.exception(
                 "error during rollback ignored, presuming automatic rollback happened"
             )
         raise
-    else:
-        cur.execute("commit")
+    finally:
+        if watchdog is not None:
+            watchdog._closed(token)
 
 
 @contextlib.contextmanager
@@ -174,6 +816,341 @@ def begin_pool(pool: Pool[_C], lock_mode: LockMode) -> Iterator[_C]:
             yield conn
 
 
+def is_busy(exc: BaseException) -> bool:
+    # SQLITE_BUSY, including extended codes like SQLITE_BUSY_SNAPSHOT
+    if isinstance(exc, sqlite3.OperationalError):
+        # sqlite_errorcode is only available on python 3.11+
+        code = getattr(exc, "sqlite_errorcode", None)
+        if code is not None:
+            return bool(code & 0xFF == 5)
+        return str(exc).startswith("database is locked")
+    apsw = sys.modules.get("apsw")
+    return apsw is not None and isinstance(exc, apsw.BusyError)
+
+
+def run_optimistic(
+    pool: Pool[_C],
+    func: Callable[[_C], _T],
+    *,
+    attempts: int = 3,
+    fallback: bool = True,
+) -> _T:
+    # Runs func in a deferred transaction. If the transaction fails with
+    # SQLITE_BUSY (typically when upgrading to a write lock), it's rolled back
+    # and func is run again in a new transaction, up to attempts times. With
+    # fallback, the last attempt uses an immediate transaction. func must be
+    # safe to re-run.
+    if attempts < 1:
+        raise ValueError("attempts must be positive")
+    for attempt in range(attempts):
+        last = attempt == attempts - 1
+        lock_mode = IMMEDIATE if last and fallback else DEFERRED
+        try:
+            with begin_pool(pool, lock_mode) as conn:
+                return func(conn)
+        except _errors() as exc:
+            if last or not is_busy(exc):
+                raise
+            _LOG.debug("transaction busy, retrying (attempt %d)", attempt + 1)
+    raise AssertionError("unreachable")  # pragma: no cover
+
+
+class WriterScheduler:
+    # Serializes in-process writers: one write transaction runs at a time,
+    # highest priority first, first-come first-served within a priority. Since
+    # writers don't contend for sqlite's write lock, they don't spin in the
+    # busy handler. Other processes may still contend.
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._active = False
+
+    @contextlib.contextmanager
+    def acquire(self, priority: int = 0) -> Iterator[None]:
+        import heapq
+
+        with self._cond:
+            key = (-priority, next(self._seq))
+            heapq.heappush(self._queue, key)
+            try:
+                while self._active or self._queue[0] != key:
+                    self._cond.wait()
+            except BaseException:
+                self._queue.remove(key)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._active = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active = False
+                self._cond.notify_all()
+
+    def waiting(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    @contextlib.contextmanager
+    def begin_pool(
+        self, pool: Pool[_C], lock_mode: LockMode, *, priority: int = 0
+    ) -> Iterator[_C]:
+        # Like begin_pool(); deferred transactions are not scheduled
+        if lock_mode == DEFERRED:
+            with begin_pool(pool, lock_mode) as conn:
+                yield conn
+            return
+        with self.acquire(priority=priority):
+            with begin_pool(pool, lock_mode) as conn:
+                yield conn
+
+
+class CheckpointStats(NamedTuple):
+    checkpoints: int
+    truncates: int
+    # As of the last checkpoint, before checkpointing
+    wal_bytes: int
+    last_duration: float
+    total_duration: float
+
+
+class _Periodic(abc.ABC):
+    # Calls run_once() every interval seconds on a background thread
+    _thread_name = "dbver"
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @abc.abstractmethod
+    def run_once(self) -> Any:
+        raise NotImplementedError  # pragma: no cover
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                self.run_once()
+            except Exception:
+                _LOG.exception("%s failed", self._thread_name)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            raise AssertionError("already started")
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=self._thread_name, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class Checkpointer(_Periodic, Generic[_C]):
+    _thread_name = "dbver-checkpointer"
+
+    # Runs wal checkpoints for a pool, so they don't run inline in writers
+    # (disable automatic checkpoints with "pragma wal_autocheckpoint = 0").
+    #
+    # Each run does a passive checkpoint. If the wal is larger than
+    # truncate_bytes, or truncate_interval has passed since the last
+    # truncate, a truncating checkpoint is done instead, while holding the
+    # writer context (for example, a lock shared with the application's
+    # writers), since it waits for writers and readers to finish.
+    def __init__(
+        self,
+        pool: Pool[_C],
+        schema: str = "main",
+        *,
+        interval: float = 1.0,
+        truncate_bytes: int = 64 << 20,
+        truncate_interval: float = None,
+        writer: Callable[[], ContextManager[Any]] = None,
+    ) -> None:
+        _check_schema(schema)
+        super().__init__(interval)
+        self._pool = pool
+        self._schema = schema
+        self._truncate_bytes = truncate_bytes
+        self._truncate_interval = truncate_interval
+        self._writer = writer
+        self._run_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._last_truncate = time.monotonic()
+        self._checkpoints = 0
+        self._truncates = 0
+        self._wal_bytes = 0
+        self._last_duration = 0.0
+        self._total_duration = 0.0
+
+    def _checkpoint(self, conn: _C, mode: str) -> Tuple[int, int]:
+        cur = cast(Any, conn.cursor())
+        ((_, log, _),) = cur.execute(
+            f'pragma "{self._schema}".wal_checkpoint({mode})'
+        ).fetchall()
+        ((page_size,),) = cur.execute(f'pragma "{self._schema}".page_size').fetchall()
+        return log, page_size
+
+    def run_once(self) -> None:
+        with self._run_lock:
+            start = time.monotonic()
+            truncated = False
+            with self._pool() as conn:
+                log, page_size = self._checkpoint(conn, "passive")
+                wal_bytes = max(log, 0) * page_size
+                if wal_bytes >= self._truncate_bytes or (
+                    self._truncate_interval is not None
+                    and start - self._last_truncate >= self._truncate_interval
+                ):
+                    with self._writer() if self._writer else contextlib.nullcontext():
+                        self._checkpoint(conn, "truncate")
+                    truncated = True
+            end = time.monotonic()
+            if truncated:
+                self._last_truncate = end
+        with self._stats_lock:
+            self._checkpoints += 1
+            if truncated:
+                self._truncates += 1
+            self._wal_bytes = wal_bytes
+            self._last_duration = end - start
+            self._total_duration += end - start
+
+    def stats(self) -> CheckpointStats:
+        with self._stats_lock:
+            return CheckpointStats(
+                checkpoints=self._checkpoints,
+                truncates=self._truncates,
+                wal_bytes=self._wal_bytes,
+                last_duration=self._last_duration,
+                total_duration=self._total_duration,
+            )
+
+
+class OpenTransaction(NamedTuple):
+    conn: Any
+    lock_mode: LockMode
+    # time.monotonic() at begin
+    started: float
+    thread: str
+    # Where begin() was called, if the watchdog records stacks. Source lines
+    # are only looked up when formatted.
+    stack: Optional[traceback.StackSummary]
+
+
+class TransactionWatchdog(_Periodic):
+    _thread_name = "dbver-watchdog"
+
+    # While started, tracks every transaction opened with begin() or
+    # begin_pool(), and every interval reports those open longer than
+    # max_duration: each is logged once as a warning and passed to callback,
+    # and with interrupt=True, its connection is interrupted, which makes its
+    # current statement fail. Only one watchdog can be started at a time.
+    # When none is, begin() pays only for a global lookup. With stacks=True,
+    # the innermost stack_limit frames of where each transaction was begun
+    # are recorded too, which makes begin() several times slower.
+    def __init__(
+        self,
+        max_duration: float,
+        *,
+        interval: float = None,
+        callback: Callable[[OpenTransaction], Any] = None,
+        interrupt: bool = False,
+        stacks: bool = False,
+        stack_limit: int = 10,
+    ) -> None:
+        super().__init__(max_duration / 4 if interval is None else interval)
+        self._max_duration = max_duration
+        self._callback = callback
+        self._interrupt = interrupt
+        self._stacks = stacks
+        self._stack_limit = stack_limit
+        self._lock = threading.Lock()
+        self._open: Dict[int, OpenTransaction] = {}
+        self._reported: Set[int] = set()
+        self._tokens = itertools.count()
+
+    def _opened(self, conn: Any, lock_mode: LockMode) -> int:
+        stack = None
+        if self._stacks:
+            # skip begin() and contextlib
+            stack = traceback.StackSummary.extract(
+                traceback.walk_stack(sys._getframe(3)),
+                limit=self._stack_limit,
+                lookup_lines=False,
+            )
+            stack.reverse()
+        record = OpenTransaction(
+            conn=conn,
+            lock_mode=lock_mode,
+            started=time.monotonic(),
+            thread=threading.current_thread().name,
+            stack=stack,
+        )
+        with self._lock:
+            token = next(self._tokens)
+            self._open[token] = record
+        return token
+
+    def _closed(self, token: int) -> None:
+        with self._lock:
+            del self._open[token]
+            self._reported.discard(token)
+
+    def open_transactions(self) -> List[OpenTransaction]:
+        with self._lock:
+            return list(self._open.values())
+
+    def run_once(self) -> List[OpenTransaction]:
+        # Reports transactions newly over max_duration, and returns them
+        now = time.monotonic()
+        with self._lock:
+            late = [
+                (token, record)
+                for token, record in self._open.items()
+                if token not in self._reported
+                and now - record.started > self._max_duration
+            ]
+            self._reported.update(token for token, _ in late)
+        for _, record in late:
+            _LOG.warning(
+                "%s transaction open for %.1fs in thread %s%s",
+                record.lock_mode.value,
+                now - record.started,
+                record.thread,
+                ""
+                if record.stack is None
+                else ", begun at:\n" + "".join(record.stack.format()),
+            )
+            if self._callback is not None:
+                self._callback(record)
+            if self._interrupt:
+                record.conn.interrupt()
+        return [record for _, record in late]
+
+    def start(self) -> None:
+        global _WATCHDOG
+        with _WATCHDOG_LOCK:
+            if _WATCHDOG is not None:
+                raise AssertionError("a watchdog is already started")
+            super().start()
+            _WATCHDOG = self
+
+    def stop(self) -> None:
+        global _WATCHDOG
+        with _WATCHDOG_LOCK:
+            if _WATCHDOG is self:
+                _WATCHDOG = None
+        super().stop()
+
+
 class Error(Exception):
     pass
 
@@ -182,6 +1159,20 @@ class VersionError(Error):
     pass
 
 
+class IntegrityError(Error):
+    def __init__(
+        self,
+        problems: Sequence["IntegrityProblem"],
+        from_format: Any = None,
+        to_format: Any = None,
+    ) -> None:
+        self.problems = list(problems)
+        self.from_format = from_format
+        self.to_format = to_format
+        where = "" if to_format is None else f"{from_format} -> {to_format}: "
+        super().__init__(f"{where}{len(self.problems)} integrity problem(s)")
+
+
 def semver_is_breaking(from_version: int, to_version: int) -> bool:
     if from_version == 0:
         return False
@@ -202,6 +1193,11 @@ def _check_schema(schema: str) -> None:
         raise ValueError("schema invalid")
 
 
+# dbver's own bookkeeping tables (like _dbver_readers, which readers may
+# create before a database is provisioned) don't make a database non-empty
+_USER_TABLES = "type = 'table' and name not like '\\_dbver\\_%' escape '\\'"
+
+
 def _check_int32(value: int) -> None:
     if not isinstance(value, int):
         raise TypeError("must be int")
@@ -252,7 +1248,7 @@ def has_tables(conn: _C, schema: str = "main") -> bool:
     # we must do string-formatted sql, and check our inputs
     _check_schema(schema)
     cur = conn.cursor()
-    cur.execute(f"select 1 from \"{schema}\".sqlite_master where type = 'table'")
+    cur.execute(f'select 1 from "{schema}".sqlite_master where {_USER_TABLES}')
     return cur.fetchone() is not None
 
 
@@ -265,14 +1261,621 @@ def check_application_id(application_id: int, conn: _C, schema: str = "main") ->
         raise VersionError("wrong application_id: " f"{have_id} != {application_id}")
 
 
+def get_schemas(conn: _C) -> List[str]:
+    cur = cast(Any, conn.cursor())
+    rows = cur.execute("select name from pragma_database_list where name != 'temp'")
+    return [name for (name,) in rows]
+
+
+def has_tables_all(conn: _C, schemas: Sequence[str]) -> Dict[str, bool]:
+    # One query for all schemas
+    if not schemas:
+        return {}
+    for schema in schemas:
+        _check_schema(schema)
+    sql = " union all ".join(
+        f'select ?, exists(select 1 from "{schema}".sqlite_master where {_USER_TABLES})'
+        for schema in schemas
+    )
+    cur = cast(Any, conn.cursor())
+    return {schema: bool(value) for schema, value in cur.execute(sql, schemas)}
+
+
+def check_application_id_all(
+    application_id: int, conn: _C, schemas: Sequence[str] = None
+) -> None:
+    # pragma functions like pragma_application_id() only read the main schema,
+    # so we can't combine the application_id probes, but we can combine the
+    # emptiness checks
+    if schemas is None:
+        schemas = get_schemas(conn)
+    unset = []
+    for schema in schemas:
+        have_id = get_application_id(conn, schema=schema)
+        if have_id == 0:
+            unset.append(schema)
+        elif have_id != application_id:
+            raise VersionError(
+                f"{schema}: wrong application_id: {have_id} != {application_id}"
+            )
+    for schema, value in has_tables_all(conn, unset).items():
+        if value:
+            raise VersionError(f"{schema}: database is not empty")
+
+
+def _check_name(name: str) -> None:
+    if not isinstance(name, str):
+        raise TypeError("name must be str")
+    if '"' in name:
+        raise ValueError("name invalid")
+
+
+def _has_table(conn: _C, schema: str, name: str) -> bool:
+    cur = cast(Any, conn.cursor())
+    cur.execute(
+        f"select 1 from \"{schema}\".sqlite_master where type = 'table' and name = ?",
+        (name,),
+    )
+    return cur.fetchone() is not None
+
+
+def _total_changes(conn: _C) -> int:
+    cur = conn.cursor()
+    cur.execute("select total_changes()")
+    (changes,) = cast(Tuple[int], cur.fetchone())
+    return changes
+
+
+def copy_rows(
+    conn: _C,
+    src: str,
+    dst: str,
+    schema: str = "main",
+    *,
+    columns: Mapping[str, str] = None,
+    transform: Callable[[Tuple], Sequence[Any]] = None,
+    batch_size: int = 1000,
+) -> int:
+    # columns maps destination column names to sql expressions over the
+    # source table. Without a transform, the whole copy is one
+    # "insert ... select" and never leaves sqlite. With a transform, rows are
+    # streamed through python in batches of batch_size, so memory use is
+    # bounded regardless of table size.
+    _check_schema(schema)
+    _check_name(src)
+    _check_name(dst)
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    if columns is None:
+        dst_cols = ""
+        select = "*"
+    else:
+        for name in columns:
+            _check_name(name)
+        dst_cols = " (" + ", ".join(f'"{name}"' for name in columns) + ")"
+        select = ", ".join(columns.values())
+    select_sql = f'select {select} from "{schema}"."{src}"'
+    before = _total_changes(conn)
+    if transform is None:
+        conn.cursor().execute(f'insert into "{schema}"."{dst}"{dst_cols} {select_sql}')
+        return _total_changes(conn) - before
+
+    # Cursor iteration and executemany() are common to sqlite3 and apsw, but
+    # not part of our Cursor protocol
+    read_cur = cast(Any, conn.cursor())
+    write_cur = cast(Any, conn.cursor())
+    rows = (transform(row) for row in read_cur.execute(select_sql))
+    insert_sql: Optional[str] = None
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        if insert_sql is None:
+            params = ", ".join("?" * len(batch[0]))
+            insert_sql = f'insert into "{schema}"."{dst}"{dst_cols} values ({params})'
+        write_cur.executemany(insert_sql, batch)
+    return _total_changes(conn) - before
+
+
+def _qualify_create(sql: str, schema: str) -> str:
+    # sqlite_master stores "create" statements normalized, with any schema
+    # name removed; the statement would create the object in main
+    match = re.match(r"CREATE (UNIQUE INDEX|INDEX|TRIGGER) ", sql)
+    if match is None:
+        raise AssertionError(f"unexpected sql: {sql}")
+    return f'{match.group()}"{schema}".{sql[match.end():]}'
+
+
+def rebuild_table(
+    conn: _C,
+    table: str,
+    definition: str,
+    schema: str = "main",
+    *,
+    columns: Mapping[str, str] = None,
+    transform: Callable[[Tuple], Sequence[Any]] = None,
+    batch_size: int = 1000,
+) -> int:
+    # The generalized "alter table" procedure from
+    # https://sqlite.org/lang_altertable.html : create the new table under a
+    # temporary name, copy, drop the old table and rename. Indexes and
+    # triggers on the table are recreated from their saved sql, so they must
+    # still be valid for the new definition. Views and triggers on other
+    # tables refer to the table by name, and are left as they are.
+    #
+    # foreign_keys must be off (it can't be changed in a transaction), as
+    # dropping the old table would otherwise run "on delete" actions. Foreign
+    # keys are checked afterward, and IntegrityError raised if the new table
+    # violates any.
+    _check_schema(schema)
+    _check_name(table)
+    tmp = f"_dbver_new_{table}"
+    cur = cast(Any, conn.cursor())
+    ((foreign_keys,),) = cur.execute("pragma foreign_keys").fetchall()
+    if foreign_keys:
+        raise Error("rebuild_table requires pragma foreign_keys = off")
+    saved = cur.execute(
+        f'select sql from "{schema}".sqlite_master '
+        "where type in ('index', 'trigger') and tbl_name = ? and sql is not null",
+        (table,),
+    ).fetchall()
+    cur.execute(f'create table "{schema}"."{tmp}" ({definition})')
+    count = copy_rows(
+        conn,
+        table,
+        tmp,
+        schema=schema,
+        columns=columns,
+        transform=transform,
+        batch_size=batch_size,
+    )
+    cur.execute(f'drop table "{schema}"."{table}"')
+    # Without legacy_alter_table, the rename fails on views referring to the
+    # (now missing) table
+    ((legacy,),) = cur.execute("pragma legacy_alter_table").fetchall()
+    cur.execute("pragma legacy_alter_table = on")
+    try:
+        cur.execute(f'alter table "{schema}"."{tmp}" rename to "{table}"')
+    finally:
+        cur.execute(f"pragma legacy_alter_table = {int(legacy)}")
+    for (sql,) in saved:
+        cur.execute(_qualify_create(sql, schema))
+    rows = cur.execute(f'pragma "{schema}".foreign_key_check').fetchall()
+    if rows:
+        raise IntegrityError(
+            [
+                IntegrityProblem(
+                    "foreign_key_check",
+                    child,
+                    f"rowid {rowid} violates foreign key {fkid} to {parent}",
+                )
+                for child, rowid, parent, fkid in rows
+            ]
+        )
+    return count
+
+
+def _create_compat_table(conn: _C, schema: str) -> None:
+    conn.cursor().execute(
+        f'create table if not exists "{schema}"._dbver_compat ('
+        "type text not null, name text not null, format int not null, "
+        "expires real, primary key (type, name))"
+    )
+
+
+def publish_compat(
+    conn: _C,
+    compat_format: int,
+    schema: str = "main",
+    *,
+    views: Mapping[str, str] = None,
+    triggers: Mapping[str, str] = None,
+    expires: float = None,
+) -> None:
+    # views maps view names to select statements. triggers maps trigger names
+    # to trigger definitions following the name, typically
+    # "instead of insert on view begin ... end". Objects are recorded as
+    # serving compat_format until the expires timestamp (or forever), and
+    # removed by retire_compat().
+    _check_schema(schema)
+    _check_int32(compat_format)
+    _create_compat_table(conn, schema)
+    cur = cast(Any, conn.cursor())
+    objects = []
+    for name, select in (views or {}).items():
+        _check_name(name)
+        cur.execute(f'create view "{schema}"."{name}" as {select}')
+        objects.append(("view", name))
+    for name, definition in (triggers or {}).items():
+        _check_name(name)
+        cur.execute(f'create trigger "{schema}"."{name}" {definition}')
+        objects.append(("trigger", name))
+    for type_, name in objects:
+        cur.execute(
+            f'insert or replace into "{schema}"._dbver_compat '
+            "(type, name, format, expires) values (?, ?, ?, ?)",
+            (type_, name, compat_format, expires),
+        )
+
+
+def retire_compat(
+    conn: _C, schema: str = "main", *, now: float = None, force: bool = False
+) -> int:
+    # Drops compat objects which expired before now, or all of them with
+    # force=True
+    _check_schema(schema)
+    if now is None:
+        now = time.time()
+    if not _has_table(conn, schema, "_dbver_compat"):
+        return 0
+    cur = cast(Any, conn.cursor())
+    expired = cur.execute(
+        f'select type, name from "{schema}"._dbver_compat ' "where ? or expires <= ? "
+        # triggers first, since they may be attached to views
+        "order by type = 'view'",
+        (force, now),
+    ).fetchall()
+    for type_, name in expired:
+        _check_name(name)
+        cur.execute(f'drop {type_} if exists "{schema}"."{name}"')
+        cur.execute(
+            f'delete from "{schema}"._dbver_compat where type = ? and name = ?',
+            (type_, name),
+        )
+    return len(expired)
+
+
+def get_compat_formats(conn: _C, schema: str = "main") -> Set[int]:
+    _check_schema(schema)
+    cur = cast(Any, conn.cursor())
+    if not _has_table(conn, schema, "_dbver_compat"):
+        return set()
+    rows = cur.execute(f'select distinct format from "{schema}"._dbver_compat')
+    return {compat_format for (compat_format,) in rows}
+
+
+class ReaderRecord(NamedTuple):
+    name: str
+    min_format: int
+    max_format: int
+    last_seen: float
+
+
+class ReaderRegistry:
+    # Records when readers were last seen, and which formats they support, in
+    # a _dbver_readers table. seen() only notes a reader in memory, so it's
+    # cheap enough for every read. Notes are written by flush(), at most once
+    # per interval: call it from write transactions the application already
+    # makes, or use flush_pool() to make a write transaction when one is due.
+    # If the transaction containing a flush rolls back, its notes are lost
+    # until readers are seen again.
+    def __init__(self, schema: str = "main", *, interval: float = 60.0) -> None:
+        _check_schema(schema)
+        self._schema = schema
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._pending: Dict[str, ReaderRecord] = {}
+        self._last_flush: Optional[float] = None
+
+    def seen(
+        self, name: str, min_format: int, max_format: int, *, now: float = None
+    ) -> None:
+        _check_int32(min_format)
+        _check_int32(max_format)
+        record = ReaderRecord(
+            name, min_format, max_format, time.time() if now is None else now
+        )
+        with self._lock:
+            self._pending[name] = record
+
+    def _due(self, now: float) -> bool:
+        # Must hold self._lock
+        return bool(self._pending) and (
+            self._last_flush is None or now - self._last_flush >= self._interval
+        )
+
+    def due(self) -> bool:
+        with self._lock:
+            return self._due(time.monotonic())
+
+    def flush(self, conn: _C, *, force: bool = False) -> int:
+        # Must be called in a write transaction. Returns the number of readers
+        # written, which is zero if no flush was due.
+        with self._lock:
+            now = time.monotonic()
+            if not self._pending or not (force or self._due(now)):
+                return 0
+            records = list(self._pending.values())
+            self._pending = {}
+            self._last_flush = now
+        cur = cast(Any, conn.cursor())
+        cur.execute(
+            f'create table if not exists "{self._schema}"._dbver_readers ('
+            "name text primary key, min_format int not null, "
+            "max_format int not null, last_seen real not null)"
+        )
+        cur.executemany(
+            f'insert into "{self._schema}"._dbver_readers '
+            "(name, min_format, max_format, last_seen) values (?, ?, ?, ?) "
+            "on conflict (name) do update set min_format = excluded.min_format, "
+            "max_format = excluded.max_format, "
+            "last_seen = max(last_seen, excluded.last_seen)",
+            records,
+        )
+        return len(records)
+
+    def flush_pool(self, pool: Pool[_C], *, force: bool = False) -> int:
+        if not force and not self.due():
+            return 0
+        with begin_pool(pool, IMMEDIATE) as conn:
+            return self.flush(conn, force=force)
+
+
+def get_readers(conn: _C, schema: str = "main") -> List[ReaderRecord]:
+    _check_schema(schema)
+    if not _has_table(conn, schema, "_dbver_readers"):
+        return []
+    cur = cast(Any, conn.cursor())
+    rows = cur.execute(
+        "select name, min_format, max_format, last_seen "
+        f'from "{schema}"._dbver_readers order by name'
+    ).fetchall()
+    return [ReaderRecord(*row) for row in rows]
+
+
+def backup(src: _C, dst: _C, schema: str = "main") -> None:
+    # Copies schema of src over the main schema of dst, with the online backup
+    # api. Both connections must be from the same library.
+    _check_schema(schema)
+    if isinstance(src, sqlite3.Connection):
+        src.backup(cast(Any, dst), name=schema)
+    else:
+        with cast(Any, dst).backup("main", src, schema) as job:
+            job.step()
+
+
+def _data_size(conn: _C) -> int:
+    cur = cast(Any, conn.cursor())
+    try:
+        ((size,),) = cur.execute("select sum(pgsize - unused) from dbstat").fetchall()
+    except _errors():
+        # dbstat is not always compiled in
+        ((pages,),) = cur.execute("pragma page_count").fetchall()
+        ((free,),) = cur.execute("pragma freelist_count").fetchall()
+        ((page_size,),) = cur.execute("pragma page_size").fetchall()
+        size = (pages - free) * page_size
+    return size or 0
+
+
+def _sample(conn: _C, fraction: float) -> None:
+    cur = cast(Any, conn.cursor())
+    tables = cur.execute(
+        "select name from sqlite_master "
+        "where type = 'table' and name not like 'sqlite_%'"
+    ).fetchall()
+    for (name,) in tables:
+        _check_name(name)
+        cur.execute(
+            f'delete from "{name}" where abs(random() % 1000000) >= ?',
+            (int(fraction * 1000000),),
+        )
+
+
+class StepEstimate(NamedTuple):
+    from_format: Any
+    to_format: Any
+    # Measured on the snapshot
+    duration: float
+    # Extrapolated to the full database
+    estimate: float
+
+
+class IntegrityProblem(NamedTuple):
+    # "integrity_check", "quick_check" or "foreign_key_check"
+    check: str
+    table: str
+    detail: str
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _check_table(
+    pool: Pool[_C], schema: str, table: str, full: bool, foreign_keys: bool
+) -> List[IntegrityProblem]:
+    check = "integrity_check" if full else "quick_check"
+    problems = []
+    with begin_pool(pool, DEFERRED) as conn:
+        cur = cast(Any, conn.cursor())
+        rows = cur.execute(f'pragma "{schema}".{check}({_quote(table)})').fetchall()
+        for (detail,) in rows:
+            if detail != "ok":
+                problems.append(IntegrityProblem(check, table, detail))
+        if foreign_keys:
+            rows = cur.execute(
+                f'pragma "{schema}".foreign_key_check({_quote(table)})'
+            ).fetchall()
+            for _, rowid, parent, fkid in rows:
+                detail = f"rowid {rowid} violates foreign key {fkid} to {parent}"
+                problems.append(IntegrityProblem("foreign_key_check", table, detail))
+    return problems
+
+
+def verify_integrity(
+    pool: Pool[_C],
+    schema: str = "main",
+    *,
+    full: bool = False,
+    foreign_keys: bool = True,
+    max_workers: int = None,
+) -> List[IntegrityProblem]:
+    # Runs quick_check (or integrity_check, with full) and foreign_key_check
+    # on each table of schema, in parallel with up to max_workers (by
+    # default, ThreadPoolExecutor's default) connections from pool, each in
+    # its own read transaction. A pool of
+    # read-only connections keeps the checks from interfering with writers.
+    # Per-table checks skip some whole-file checks, such as for unused pages.
+    import concurrent.futures
+
+    _check_schema(schema)
+    with begin_pool(pool, DEFERRED) as conn:
+        cur = cast(Any, conn.cursor())
+        tables = [
+            name
+            for (name,) in cur.execute(
+                f'select name from "{schema}".sqlite_master '
+                "where type = 'table' and sql not like 'create virtual %'"
+            ).fetchall()
+        ]
+    if not tables:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix="dbver-verify",
+    ) as executor:
+        futures = [
+            executor.submit(_check_table, pool, schema, table, full, foreign_keys)
+            for table in tables
+        ]
+        concurrent.futures.wait(futures)
+    return [problem for future in futures for problem in future.result()]
+
+
+def _fsync_dir(path: str) -> None:
+    # Not all platforms can open or fsync a directory
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
 Migration = Callable[[_C, str], None]
-_T = TypeVar("_T")
+
+
+# Formats are written to the journal as-is, so must be types sqlite can store
+class JournalEntry(NamedTuple):
+    from_format: Any
+    to_format: Any
+    started: float
+    duration: float
+    changes: int
+
+
+def _write_journal(conn: _C, schema: str, entry: JournalEntry) -> None:
+    cur = cast(Any, conn.cursor())
+    cur.execute(
+        f'create table if not exists "{schema}"._dbver_journal ('
+        "id integer primary key, from_format, to_format, started real not null, "
+        "duration real not null, changes int not null)"
+    )
+    cur.execute(
+        f'insert into "{schema}"._dbver_journal '
+        "(from_format, to_format, started, duration, changes) "
+        "values (?, ?, ?, ?, ?)",
+        entry,
+    )
+
+
+def get_journal(conn: _C, schema: str = "main") -> List[JournalEntry]:
+    _check_schema(schema)
+    cur = cast(Any, conn.cursor())
+    if not _has_table(conn, schema, "_dbver_journal"):
+        return []
+    rows = cur.execute(
+        "select from_format, to_format, started, duration, changes "
+        f'from "{schema}"._dbver_journal order by id'
+    )
+    return [JournalEntry(*row) for row in rows]
+
+
+def schema_fingerprint(conn: _C, schema: str = "main") -> str:
+    # A hash of the schema's sqlite_master, ignoring sqlite's and dbver's own
+    # tables, compat objects (see publish_compat(), as they come and go
+    # within a format) and differences in whitespace
+    import hashlib
+
+    _check_schema(schema)
+    cur = cast(Any, conn.cursor())
+    query = (
+        f'select type, name, tbl_name, sql from "{schema}".sqlite_master m '
+        "where name not like 'sqlite\\_%' escape '\\' "
+        "and name not like '\\_dbver\\_%' escape '\\' "
+    )
+    if _has_table(conn, schema, "_dbver_compat"):
+        query += (
+            f'and not exists (select 1 from "{schema}"._dbver_compat c '
+            "where c.type = m.type and c.name = m.name) "
+        )
+    rows = cur.execute(query + "order by type, name").fetchall()
+    digest = hashlib.sha256()
+    for type_, name, tbl_name, sql in rows:
+        sql = "" if sql is None else " ".join(sql.split())
+        for value in (type_, name, tbl_name, sql):
+            digest.update(value.encode())
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FingerprintCache:
+    # Caches schema_fingerprint() per database file, recomputing it only when
+    # the schema cookie (pragma schema_version) changes. In-memory and
+    # temporary databases aren't cached.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[int, str]] = {}
+
+    def get(self, conn: _C, schema: str = "main") -> str:
+        _check_schema(schema)
+        cur = cast(Any, conn.cursor())
+        rows = cur.execute("select name, file from pragma_database_list").fetchall()
+        files = {name: file for name, file in rows}
+        path = files.get(schema)
+        if not path:
+            return schema_fingerprint(conn, schema=schema)
+        ((cookie,),) = cur.execute(f'pragma "{schema}".schema_version').fetchall()
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached is not None and cached[0] == cookie:
+            return cached[1]
+        fingerprint = schema_fingerprint(conn, schema=schema)
+        with self._lock:
+            self._cache[path] = (cookie, fingerprint)
+        return fingerprint
+
+
+def _write_fingerprint(conn: _C, schema: str, format: Any) -> None:
+    cur = cast(Any, conn.cursor())
+    cur.execute(
+        f'create table if not exists "{schema}"._dbver_fingerprints ('
+        "format primary key, fingerprint text not null)"
+    )
+    cur.execute(
+        f'insert or replace into "{schema}"._dbver_fingerprints '
+        "(format, fingerprint) values (?, ?)",
+        (format, schema_fingerprint(conn, schema=schema)),
+    )
 
 
 class Migrations(abc.ABC, collections.abc.Mapping, Generic[_T, _C]):
-    def __init__(self, *, application_id: int = 0) -> None:
+    def __init__(
+        self,
+        *,
+        application_id: int = 0,
+        journal: bool = False,
+        fingerprints: bool = False,
+    ) -> None:
         self._forward: Dict[_T, Dict[_T, Migration]] = {}
         self._application_id = application_id
+        self._journal = journal
+        self._fingerprints = fingerprints
+        self._fingerprint_cache = FingerprintCache()
 
     def __getitem__(self, key: _T) -> Mapping[_T, Migration[_C]]:
         return self._forward[key]
@@ -291,6 +1894,20 @@ class Migrations(abc.ABC, collections.abc.Mapping, Generic[_T, _C]):
         self.check(conn, schema=schema)
         return self.get_format_unchecked(conn, schema=schema)
 
+    def check_all(self, conn: _C, schemas: Sequence[str] = None) -> None:
+        if schemas is None:
+            schemas = get_schemas(conn)
+        if self._application_id != 0:
+            check_application_id_all(self._application_id, conn, schemas=schemas)
+
+    def get_format_all(self, conn: _C, schemas: Sequence[str] = None) -> Dict[str, _T]:
+        if schemas is None:
+            schemas = get_schemas(conn)
+        self.check_all(conn, schemas=schemas)
+        return {
+            schema: self.get_format_unchecked(conn, schema=schema) for schema in schemas
+        }
+
     @abc.abstractmethod
     def get_format_unchecked(self, conn: _C, schema: str = "main") -> _T:
         raise NotImplementedError  # pragma: no cover
@@ -305,8 +1922,25 @@ class Migrations(abc.ABC, collections.abc.Mapping, Generic[_T, _C]):
     ) -> Migration[_C]:
         @functools.wraps(migration)
         def wrapped(conn: _C, schema: str = "main") -> None:
-            migration(conn, schema)
-            self.set_format(to_format, conn, schema=schema)
+            if not self._journal:
+                migration(conn, schema)
+                self.set_format(to_format, conn, schema=schema)
+            else:
+                started = time.time()
+                start = time.monotonic()
+                before = _total_changes(conn)
+                migration(conn, schema)
+                self.set_format(to_format, conn, schema=schema)
+                entry = JournalEntry(
+                    from_format=from_format,
+                    to_format=to_format,
+                    started=started,
+                    duration=time.monotonic() - start,
+                    changes=_total_changes(conn) - before,
+                )
+                _write_journal(conn, schema, entry)
+            if self._fingerprints:
+                _write_fingerprint(conn, schema, to_format)
 
         self._forward.setdefault(from_format, {})
         self._forward[from_format][to_format] = wrapped
@@ -320,6 +1954,33 @@ class Migrations(abc.ABC, collections.abc.Mapping, Generic[_T, _C]):
 
         return wrap
 
+    def get_fingerprint(self, conn: _C, schema: str = "main") -> str:
+        # schema_fingerprint(), cached until the schema changes
+        return self._fingerprint_cache.get(conn, schema=schema)
+
+    def check_fingerprint(
+        self, conn: _C, schema: str = "main", *, expected: Mapping[_T, str] = None
+    ) -> None:
+        # Raises VersionError if the schema differs from what's expected of
+        # its format: from expected (such as from build_fingerprints()), or
+        # else as recorded when migrations ran with fingerprints=True. Formats
+        # with no expected fingerprint aren't checked.
+        have_format = self.get_format(conn, schema=schema)
+        if expected is not None:
+            want = expected.get(have_format)
+        elif _has_table(conn, schema, "_dbver_fingerprints"):
+            cur = cast(Any, conn.cursor())
+            rows = cur.execute(
+                f'select fingerprint from "{schema}"._dbver_fingerprints '
+                "where format = ?",
+                (have_format,),
+            ).fetchall()
+            want = rows[0][0] if rows else None
+        else:
+            want = None
+        if want is not None and self.get_fingerprint(conn, schema=schema) != want:
+            raise VersionError(f"schema has drifted from format {have_format}")
+
 
 class _SupportsLessThan(Protocol):
     def __lt__(self, __other: Any) -> bool:
@@ -342,6 +2003,27 @@ class VersionMigrations(Migrations[_LT, _C]):
             )
         return super().add(from_format, to_format, migration)
 
+    def _get_condition(
+        self, condition: Optional[Callable[[_LT, _LT], Any]], breaking: bool
+    ) -> Callable[[_LT, _LT], Any]:
+        if condition is not None:
+            return condition
+
+        def default_condition(orig: _LT, new: _LT) -> bool:
+            return breaking or not self.is_breaking(orig, new)
+
+        return default_condition
+
+    def _next_format(
+        self, orig: _LT, cur: _LT, condition: Callable[[_LT, _LT], Any]
+    ) -> Optional[_LT]:
+        candidates = self.get(cur, {}).keys()
+        allowed = [fmt for fmt in candidates if condition(orig, fmt)]
+        if not allowed:
+            return None
+        new: _LT = max(allowed)
+        return new
+
     def upgrade(
         self,
         conn: _C,
@@ -349,26 +2031,273 @@ class VersionMigrations(Migrations[_LT, _C]):
         *,
         condition: Callable[[_LT, _LT], Any] = None,
         breaking: bool = False,
+        pragmas: Pragmas = None,
     ) -> _LT:
-        if condition is None:
+        # pragmas are applied to schema while migrations run. See pragma_scope.
+        # Since upgrade() runs in the caller's transaction, pragmas which
+        # can't change within one are rejected; use upgrade_in_transaction()
+        # for those.
+        for name in pragmas or {}:
+            if name in _NON_TRANSACTIONAL_PRAGMAS:
+                raise ValueError(
+                    f"pragma {name} can't change within a transaction; "
+                    "use upgrade_in_transaction()"
+                )
+        condition = self._get_condition(condition, breaking)
+        orig = self.get_format(conn, schema=schema)
+        if self._next_format(orig, orig, condition) is None:
+            return orig
+        with pragma_scope(conn, pragmas or {}, schema=schema):
+            return self._upgrade_from(orig, conn, schema, condition)
 
-            def condition(orig: _LT, new: _LT) -> bool:
-                return breaking or not self.is_breaking(orig, new)
+    def upgrade_in_transaction(
+        self,
+        conn: _C,
+        schema: str = "main",
+        *,
+        lock_mode: LockMode = IMMEDIATE,
+        condition: Callable[[_LT, _LT], Any] = None,
+        breaking: bool = False,
+        pragmas: Pragmas = None,
+        checkpoint: bool = False,
+    ) -> _LT:
+        # Like upgrade(), in a transaction of its own, with pragmas applied
+        # around the transaction. Any pragma may be used, such as those in
+        # BULK_LOAD_PRAGMAS. With checkpoint, a truncating wal checkpoint is
+        # done afterward; see pragma_scope.
+        with pragma_scope(conn, pragmas or {}, schema=schema, checkpoint=checkpoint):
+            with begin(conn, lock_mode):
+                return self.upgrade(
+                    conn, schema=schema, condition=condition, breaking=breaking
+                )
+
+    def _upgrade_from(
+        self, orig: _LT, conn: _C, schema: str, condition: Callable[[_LT, _LT], Any]
+    ) -> _LT:
+        cur = orig
+        while True:
+            new = self._next_format(orig, cur, condition)
+            if new is None:
+                break
+            _LOG.debug("upgrading %s to version %s", schema, new)
+            self[cur][new](conn, schema)
+            cur = new
+        return cur
 
-        assert condition is not None  # makes mypy happy
+    def upgrade_all(
+        self,
+        conn: _C,
+        schemas: Sequence[str] = None,
+        *,
+        condition: Callable[[_LT, _LT], Any] = None,
+        breaking: bool = False,
+    ) -> Dict[str, _LT]:
+        # Like upgrade(), for several schemas. All schemas are checked before
+        # any is migrated. As with upgrade(), transaction boundaries are up to
+        # the caller; a single transaction across all attached schemas will
+        # commit them atomically.
+        condition = self._get_condition(condition, breaking)
+        return {
+            schema: self._upgrade_from(orig, conn, schema, condition)
+            for schema, orig in self.get_format_all(conn, schemas=schemas).items()
+        }
+
+    def plan(
+        self,
+        conn: _C,
+        schema: str = "main",
+        *,
+        condition: Callable[[_LT, _LT], Any] = None,
+        breaking: bool = False,
+    ) -> List[Tuple[_LT, _LT]]:
+        # The steps upgrade() would take
+        condition = self._get_condition(condition, breaking)
         orig = self.get_format(conn, schema=schema)
+        steps = []
         cur = orig
         while True:
-            migrations = self.get(cur, {})
-            candidates = migrations.keys()
-            allowed = [fmt for fmt in candidates if condition(orig, fmt)]
-            if not allowed:
+            new = self._next_format(orig, cur, condition)
+            if new is None:
                 break
-            new = max(allowed)
-            _LOG.debug("upgrading to version %s", new)
-            migrations[new](conn, schema)
+            steps.append((cur, new))
             cur = new
-        return cur
+        return steps
+
+    def upgrade_verified(
+        self,
+        pool: Pool[_C],
+        schema: str = "main",
+        *,
+        condition: Callable[[_LT, _LT], Any] = None,
+        breaking: bool = False,
+        verify_pool: Pool[_C] = None,
+        full: bool = False,
+        max_workers: int = None,
+    ) -> _LT:
+        # Like upgrade(), but each step commits in its own immediate
+        # transaction and is followed by verify_integrity() using verify_pool
+        # (by default, pool). If a step introduces problems, IntegrityError is
+        # raised naming that step; the database is left at the step's
+        # to_format. The database is verified before the first step too, and
+        # any problems it already has are raised without a step, before
+        # anything is migrated.
+        condition = self._get_condition(condition, breaking)
+        verify_pool = verify_pool or pool
+        with begin_pool(pool, DEFERRED) as conn:
+            orig = self.get_format(conn, schema=schema)
+        if self._next_format(orig, orig, condition) is None:
+            return orig
+        problems = verify_integrity(
+            verify_pool, schema, full=full, max_workers=max_workers
+        )
+        if problems:
+            raise IntegrityError(problems)
+        while True:
+            with begin_pool(pool, IMMEDIATE) as conn:
+                cur = self.get_format(conn, schema=schema)
+                new = self._next_format(orig, cur, condition)
+                if new is None:
+                    return cur
+                _LOG.debug("upgrading %s to version %s", schema, new)
+                self[cur][new](conn, schema)
+            problems = verify_integrity(
+                verify_pool, schema, full=full, max_workers=max_workers
+            )
+            if problems:
+                raise IntegrityError(problems, cur, new)
+
+    def build_fingerprints(
+        self,
+        connect: Callable[[str], _C],
+        *,
+        path: str = ":memory:",
+        condition: Callable[[_LT, _LT], Any] = None,
+    ) -> Dict[_LT, str]:
+        # The fingerprint of each format upgrade() passes through when
+        # provisioning an empty database at path (opened with connect). By
+        # default all steps are taken, including breaking ones.
+        condition = self._get_condition(condition, True)
+        scratch = connect(path)
+        try:
+            orig = self.get_format(scratch)
+            result = {orig: schema_fingerprint(scratch)}
+            cur = orig
+            while True:
+                new = self._next_format(orig, cur, condition)
+                if new is None:
+                    break
+                with begin(scratch, IMMEDIATE):
+                    self[cur][new](scratch, "main")
+                result[new] = schema_fingerprint(scratch)
+                cur = new
+        finally:
+            scratch.close()
+        return result
+
+    def dry_run(
+        self,
+        conn: _C,
+        connect: Callable[[str], _C],
+        schema: str = "main",
+        *,
+        path: str = ":memory:",
+        sample: float = None,
+        condition: Callable[[_LT, _LT], Any] = None,
+        breaking: bool = False,
+    ) -> List[StepEstimate]:
+        # Runs upgrade() on a snapshot of schema, timing each step. The
+        # snapshot is made with the backup api into path (opened with
+        # connect). With sample, only about that fraction of each table's rows
+        # are kept, and step times are extrapolated by data size.
+        if sample is not None and not 0 < sample <= 1:
+            raise ValueError("sample must be in (0, 1]")
+        steps = self.plan(conn, schema=schema, condition=condition, breaking=breaking)
+        snapshot = connect(path)
+        try:
+            backup(conn, snapshot, schema=schema)
+            full_size = _data_size(snapshot)
+            if sample is not None:
+                with begin(snapshot, IMMEDIATE):
+                    _sample(snapshot, sample)
+            sample_size = _data_size(snapshot)
+            scale = full_size / sample_size if sample_size else 1.0
+            result = []
+            for cur, new in steps:
+                start = time.monotonic()
+                with begin(snapshot, IMMEDIATE):
+                    self[cur][new](snapshot, "main")
+                duration = time.monotonic() - start
+                result.append(StepEstimate(cur, new, duration, duration * scale))
+        finally:
+            snapshot.close()
+        return result
+
+    def upgrade_rebuild(
+        self,
+        path: str,
+        connect: Callable[[str], _C],
+        *,
+        condition: Callable[[_LT, _LT], Any] = None,
+        breaking: bool = False,
+    ) -> _LT:
+        # Offline upgrade of the "main" schema of the database file at path.
+        # The database is copied with "vacuum into", the copy is migrated with
+        # journaling disabled, then renamed over the original while we hold an
+        # exclusive lock on it. Other connections to the original file will
+        # keep referring to the old file, and must be reopened.
+        condition = self._get_condition(condition, breaking)
+        tmp = f"{path}-dbver-rebuild"
+        conn = connect(path)
+        try:
+            cur = cast(Any, conn.cursor())
+            # In exclusive locking mode, locks are never released until the
+            # connection is closed
+            cur.execute("pragma locking_mode = exclusive")
+            ((journal_mode,),) = cur.execute("pragma journal_mode").fetchall()
+            if not journal_mode.isalpha():
+                raise AssertionError(f"unexpected journal_mode: {journal_mode}")
+            with begin(conn, EXCLUSIVE):
+                orig = self.get_format(conn)
+            if self._next_format(orig, orig, condition) is None:
+                return orig
+            if journal_mode == "wal":
+                # Checkpoint and remove the wal file, so no stale wal will be
+                # applied to the new file
+                cur.execute("pragma journal_mode = delete")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp)
+            try:
+                cur.execute("vacuum into ?", (tmp,))
+                scratch = connect(tmp)
+                try:
+                    scratch_cur = scratch.cursor()
+                    # Nothing to protect until the rename
+                    scratch_cur.execute("pragma journal_mode = off")
+                    scratch_cur.execute("pragma synchronous = off")
+                    with begin(scratch, EXCLUSIVE):
+                        new = self.upgrade(scratch, condition=condition)
+                    scratch_cur.execute("vacuum")
+                    if self.get_format(scratch) != new:
+                        raise VersionError(f"rebuild did not reach version {new}")
+                    scratch_cur.execute(f"pragma journal_mode = {journal_mode}")
+                finally:
+                    scratch.close()
+                with open(tmp, "rb+") as fp:
+                    os.fsync(fp.fileno())
+                os.replace(tmp, path)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(tmp)
+                if journal_mode == "wal":
+                    try:
+                        cur.execute(f"pragma journal_mode = {journal_mode}")
+                    except _errors():
+                        _LOG.exception("error restoring journal_mode ignored")
+                raise
+            _fsync_dir(os.path.dirname(os.path.abspath(path)))
+        finally:
+            conn.close()
+        return new
 
 
 class UserVersionMigrations(VersionMigrations[int, _C]):
@@ -383,3 +2312,628 @@ class UserVersionMigrations(VersionMigrations[int, _C]):
 class SemverMigrations(UserVersionMigrations[_C]):
     def is_breaking(self, from_format: int, to_format: int) -> bool:
         return semver_is_breaking(from_format, to_format)
+
+    def add_compat(
+        self,
+        from_format: int,
+        to_format: int,
+        migration: Migration[_C],
+        *,
+        views: Mapping[str, str] = None,
+        triggers: Mapping[str, str] = None,
+        grace: float = None,
+    ) -> Migration[_C]:
+        # A breaking migration which leaves views and "instead of" triggers
+        # emulating from_format, for grace seconds (or until retired). The
+        # compat objects are committed along with the new tables, so old
+        # readers never observe a schema without either.
+        def compat_migration(conn: _C, schema: str) -> None:
+            migration(conn, schema)
+            expires = None if grace is None else time.time() + grace
+            publish_compat(
+                conn,
+                from_format,
+                schema,
+                views=views,
+                triggers=triggers,
+                expires=expires,
+            )
+
+        return self.add(
+            from_format, to_format, functools.wraps(migration)(compat_migration)
+        )
+
+    def migrates_compat(
+        self,
+        from_format: int,
+        to_format: int,
+        *,
+        views: Mapping[str, str] = None,
+        triggers: Mapping[str, str] = None,
+        grace: float = None,
+    ) -> Callable[[Migration[_C]], Migration[_C]]:
+        def wrap(migration: Migration[_C]) -> Migration[_C]:
+            return self.add_compat(
+                from_format,
+                to_format,
+                migration,
+                views=views,
+                triggers=triggers,
+                grace=grace,
+            )
+
+        return wrap
+
+    def is_compatible(self, reader_format: int, conn: _C, schema: str = "main") -> bool:
+        # Whether a reader supporting reader_format can read the database,
+        # either directly or through compat objects
+        have = self.get_format(conn, schema=schema)
+        if not self.is_breaking(reader_format, have):
+            return True
+        return any(
+            not self.is_breaking(reader_format, compat_format)
+            for compat_format in get_compat_formats(conn, schema=schema)
+        )
+
+    def blocking_readers(
+        self,
+        to_format: int,
+        conn: _C,
+        schema: str = "main",
+        *,
+        since: float = None,
+    ) -> List[ReaderRecord]:
+        # Readers recorded by ReaderRegistry (and seen since the since
+        # timestamp) which support no format that can read to_format. A
+        # breaking upgrade to to_format is safe when there are none.
+        def can_read(reader: ReaderRecord) -> bool:
+            # the oldest version in the reader's range with the same major
+            # version as to_format is its best candidate
+            floor = to_format - to_format % 1000000
+            candidate = min(max(floor, reader.min_format), reader.max_format)
+            return not self.is_breaking(candidate, to_format)
+
+        return [
+            reader
+            for reader in get_readers(conn, schema=schema)
+            if (since is None or reader.last_seen >= since) and not can_read(reader)
+        ]
+
+
+class FormatWatcher(_Periodic, Generic[_T, _C]):
+    # Notices when other connections change the format of a database.
+    # "pragma data_version" is polled on a dedicated connection, which must
+    # not be used for anything else, since data_version doesn't change for a
+    # connection's own commits. The format is only read when data_version
+    # changes. Callbacks are called with (old, new) formats from poll(),
+    # which runs every interval seconds after start(). As that's on another
+    # thread, start() raises ValueError for a sqlite3 connection without
+    # check_same_thread=False.
+    _thread_name = "dbver-format-watcher"
+
+    def __init__(
+        self,
+        migrations: Migrations[_T, _C],
+        conn: _C,
+        schema: str = "main",
+        *,
+        interval: float = 1.0,
+    ) -> None:
+        _check_schema(schema)
+        super().__init__(interval)
+        self._migrations = migrations
+        self._conn = conn
+        self._schema = schema
+        self._callbacks: List[Callable[[_T, _T], Any]] = []
+        self._lock = threading.Lock()
+        self._data_version = self._get_data_version()
+        self._format = self._get_format()
+
+    def _get_data_version(self) -> int:
+        cur = cast(Any, self._conn.cursor())
+        ((data_version,),) = cur.execute(
+            f'pragma "{self._schema}".data_version'
+        ).fetchall()
+        return cast(int, data_version)
+
+    def _get_format(self) -> _T:
+        with begin(self._conn, DEFERRED):
+            return self._migrations.get_format(self._conn, schema=self._schema)
+
+    @property
+    def format(self) -> _T:
+        return self._format
+
+    def add_callback(self, callback: Callable[[_T, _T], Any]) -> None:
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[_T, _T], Any]) -> None:
+        with self._lock:
+            self._callbacks.remove(callback)
+
+    def poll(self) -> bool:
+        # Returns whether the format changed
+        with self._lock:
+            data_version = self._get_data_version()
+            if data_version == self._data_version:
+                return False
+            self._data_version = data_version
+            new = self._get_format()
+            old = self._format
+            if new == old:
+                return False
+            self._format = new
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback(old, new)
+        return True
+
+    def run_once(self) -> bool:
+        return self.poll()
+
+    def start(self) -> None:
+        bound: List[bool] = []
+        probe = threading.Thread(
+            target=lambda: bound.append(_is_thread_bound(self._conn))
+        )
+        probe.start()
+        probe.join()
+        if bound[0]:
+            raise ValueError(
+                "FormatWatcher needs a connection usable from other threads: "
+                "sqlite3 connections need check_same_thread=False"
+            )
+        super().start()
+
+
+class Shards(Generic[_C]):
+    # A set of databases, each with its own pool, with keys routed to shards
+    # by route(key) -> index. Schema management and fan_out() operate on all
+    # shards concurrently, with up to max_workers threads.
+    def __init__(
+        self,
+        pools: Sequence[Pool[_C]],
+        route: Callable[[Any], int],
+        *,
+        max_workers: int = None,
+    ) -> None:
+        if not pools:
+            raise ValueError("need at least one shard")
+        self.pools = list(pools)
+        self._route = route
+        self._max_workers = max_workers
+
+    def __len__(self) -> int:
+        return len(self.pools)
+
+    def pool_for(self, key: Any) -> Pool[_C]:
+        return self.pools[self._route(key) % len(self.pools)]
+
+    def map(self, func: Callable[[Pool[_C]], _T]) -> List[_T]:
+        # Calls func on each shard's pool concurrently. If any call fails, the
+        # first failure is raised after all calls finish.
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self._max_workers or len(self.pools),
+            thread_name_prefix="dbver-shards",
+        ) as executor:
+            futures = [executor.submit(func, pool) for pool in self.pools]
+            concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+
+    def check(self, migrations: Migrations[Any, _C], schema: str = "main") -> None:
+        def check_one(pool: Pool[_C]) -> None:
+            with begin_pool(pool, DEFERRED) as conn:
+                migrations.check(conn, schema=schema)
+
+        self.map(check_one)
+
+    def get_formats(
+        self, migrations: Migrations[_T, _C], schema: str = "main"
+    ) -> List[_T]:
+        def get_one(pool: Pool[_C]) -> _T:
+            with begin_pool(pool, DEFERRED) as conn:
+                return migrations.get_format(conn, schema=schema)
+
+        return self.map(get_one)
+
+    def upgrade(
+        self,
+        migrations: VersionMigrations[_LT, _C],
+        schema: str = "main",
+        *,
+        condition: Callable[[_LT, _LT], Any] = None,
+        breaking: bool = False,
+        verify: bool = False,
+        max_workers: int = None,
+    ) -> List[_LT]:
+        # Each shard is upgraded in its own immediate transaction, so a
+        # failure on one shard doesn't roll back the others. With verify, each
+        # shard uses upgrade_verified() instead, with max_workers.
+        def upgrade_one(pool: Pool[_C]) -> _LT:
+            if verify:
+                return migrations.upgrade_verified(
+                    pool,
+                    schema=schema,
+                    condition=condition,
+                    breaking=breaking,
+                    max_workers=max_workers,
+                )
+            with begin_pool(pool, IMMEDIATE) as conn:
+                return migrations.upgrade(
+                    conn, schema=schema, condition=condition, breaking=breaking
+                )
+
+        return self.map(upgrade_one)
+
+    def verify_integrity(
+        self, schema: str = "main", *, full: bool = False, max_workers: int = None
+    ) -> List[List[IntegrityProblem]]:
+        # max_workers is per shard, as for verify_integrity()
+        def verify_one(pool: Pool[_C]) -> List[IntegrityProblem]:
+            return verify_integrity(pool, schema, full=full, max_workers=max_workers)
+
+        return self.map(verify_one)
+
+    def fan_out(
+        self,
+        sql: str,
+        bindings: Iterable[Any] = (),
+        *,
+        key: Callable[[Any], Any] = None,
+        buffer: int = 256,
+    ) -> Generator[Any, None, None]:
+        # Runs a query on every shard concurrently, each in a deferred
+        # transaction, yielding rows as they arrive. With key, each shard's
+        # results must already be sorted by key, and are merged in order.
+        # At most buffer rows per shard are held in memory.
+        import heapq
+        import queue
+
+        bindings = tuple(bindings)
+        stop = threading.Event()
+        # Without key, all shards share one queue
+        queues: List["queue.Queue[Any]"] = (
+            [queue.Queue(maxsize=buffer) for _ in self.pools]
+            if key is not None
+            else [queue.Queue(maxsize=buffer * len(self.pools))] * len(self.pools)
+        )
+        done = object()
+
+        def put(q: "queue.Queue[Any]", item: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce(pool: Pool[_C], q: "queue.Queue[Any]") -> None:
+            try:
+                with begin_pool(pool, DEFERRED) as conn:
+                    for row in cast(Any, conn.cursor()).execute(sql, bindings):
+                        if not put(q, row):
+                            return
+            except BaseException as exc:
+                put(q, _FanOutError(exc))
+            else:
+                put(q, done)
+
+        def consume(q: "queue.Queue[Any]", producers: int) -> Iterator[Any]:
+            while producers:
+                item = q.get()
+                if item is done:
+                    producers -= 1
+                elif isinstance(item, _FanOutError):
+                    raise item.exc
+                else:
+                    yield item
+
+        threads = [
+            threading.Thread(
+                target=produce, args=(pool, q), name="dbver-fan-out", daemon=True
+            )
+            for pool, q in zip(self.pools, queues)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            if key is not None:
+                yield from heapq.merge(*(consume(q, 1) for q in queues), key=key)
+            else:
+                yield from consume(queues[0], len(self.pools))
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+
+class _FanOutError:
+    def __init__(self, exc: BaseException) -> None:
+        self.exc = exc
+
+
+# Workload record and replay. Transactions run through a Recorder are logged
+# as json lines: start offset, lock mode, duration, think time (the idle gap
+# since the same thread's previous transaction) and each statement with the
+# shape of its bindings. Bound values are only logged with values=True;
+# otherwise replay() binds placeholder values of the recorded types.
+
+
+class TxRecord(NamedTuple):
+    start: float
+    lock_mode: LockMode
+    duration: float
+    think: float
+    # (sql, binding shape, bound values or None)
+    statements: List[Tuple[str, Any, Any]]
+
+
+_PLACEHOLDERS: Dict[str, Any] = {
+    "int": 0,
+    "float": 0.0,
+    "str": "",
+    "bytes": b"",
+    "null": None,
+}
+
+
+def _bind_type(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "bytes"
+    return type(value).__name__
+
+
+def _bind_value(value: Any) -> Any:
+    # json has no bytes type
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"x": bytes(value).hex()}
+    return value
+
+
+def _unbind_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        return bytes.fromhex(value["x"])
+    return value
+
+
+def _bind_shape(bindings: Any) -> Any:
+    if bindings is None:
+        return None
+    if isinstance(bindings, collections.abc.Mapping):
+        return {k: _bind_type(v) for k, v in bindings.items()}
+    return [_bind_type(v) for v in bindings]
+
+
+def _bind_values(bindings: Any) -> Any:
+    if bindings is None:
+        return None
+    if isinstance(bindings, collections.abc.Mapping):
+        return {k: _bind_value(v) for k, v in bindings.items()}
+    return [_bind_value(v) for v in bindings]
+
+
+def _replay_bindings(shape: Any, values: Any) -> Any:
+    if values is not None:
+        if isinstance(values, dict):
+            return {k: _unbind_value(v) for k, v in values.items()}
+        return [_unbind_value(v) for v in values]
+    if shape is None:
+        return ()
+    if isinstance(shape, dict):
+        return {k: _PLACEHOLDERS.get(t) for k, t in shape.items()}
+    return [_PLACEHOLDERS.get(t) for t in shape]
+
+
+class _RecordingCursor:
+    def __init__(
+        self, cursor: Any, tx: List[Tuple[str, Any, Any]], values: bool
+    ) -> None:
+        self._cursor = cursor
+        self._tx = tx
+        self._values = values
+
+    def _record(self, sql: str, bindings: Any) -> None:
+        values = _bind_values(bindings) if self._values else None
+        self._tx.append((sql, _bind_shape(bindings), values))
+
+    def execute(self, sql: str, bindings: Any = None) -> Any:
+        self._record(sql, bindings)
+        if bindings is None:
+            result = self._cursor.execute(sql)
+        else:
+            result = self._cursor.execute(sql, bindings)
+        return self if result is self._cursor else result
+
+    def executemany(self, sql: str, seq_of_bindings: Iterable[Any]) -> Any:
+        rows = list(seq_of_bindings)
+        for bindings in rows:
+            self._record(sql, bindings)
+        result = self._cursor.executemany(sql, rows)
+        return self if result is self._cursor else result
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._cursor)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+
+class _RecordingConnection:
+    def __init__(self, conn: Any, tx: List[Tuple[str, Any, Any]], values: bool) -> None:
+        self._conn = conn
+        self._tx = tx
+        self._values = values
+
+    def cursor(self) -> _RecordingCursor:
+        return _RecordingCursor(self._conn.cursor(), self._tx, self._values)
+
+    def execute(self, sql: str, bindings: Any = None) -> Any:
+        return self.cursor().execute(sql, bindings)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+
+class Recorder(Generic[_C]):
+    # Wraps a pool. Transactions run with begin() are recorded to path. The
+    # yielded connection is a proxy which records cursor().execute(),
+    # executemany() and (for sqlite3) execute(); other use is passed through
+    # unrecorded.
+    def __init__(self, pool: Pool[_C], path: str, *, values: bool = False) -> None:
+        self._pool = pool
+        self._values = values
+        self._file = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._epoch = time.monotonic()
+
+    @contextlib.contextmanager
+    def begin(self, lock_mode: LockMode) -> Iterator[_C]:
+        import json
+
+        tx: List[Tuple[str, Any, Any]] = []
+        start = time.monotonic()
+        last_end = getattr(self._local, "last_end", None)
+        think = 0.0 if last_end is None else start - last_end
+        try:
+            with begin_pool(self._pool, lock_mode) as conn:
+                yield cast(_C, _RecordingConnection(conn, tx, self._values))
+        finally:
+            end = time.monotonic()
+            self._local.last_end = end
+            line = json.dumps(
+                [start - self._epoch, lock_mode.value, end - start, think, tx],
+                separators=(",", ":"),
+            )
+            with self._lock:
+                self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> "Recorder[_C]":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def read_workload(path: str) -> Iterator[TxRecord]:
+    import json
+
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            start, lock_mode, duration, think, statements = json.loads(line)
+            yield TxRecord(
+                start=start,
+                lock_mode=LockMode(lock_mode),
+                duration=duration,
+                think=think,
+                statements=[(sql, shape, values) for sql, shape, values in statements],
+            )
+
+
+class ReplayStats(NamedTuple):
+    transactions: int
+    errors: int
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+
+
+def _percentile(ordered: Sequence[float], p: float) -> float:
+    # nearest-rank
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(p * len(ordered)))
+    return ordered[rank - 1]
+
+
+def replay(
+    pool: Pool[_C],
+    records: Iterable[TxRecord],
+    *,
+    concurrency: int = 1,
+    speed: Optional[float] = 1.0,
+) -> Dict[LockMode, ReplayStats]:
+    # Re-runs recorded transactions with up to concurrency threads. Each
+    # transaction starts no earlier than its recorded start offset divided by
+    # speed; with speed=None transactions run back to back. Failed
+    # transactions are counted as errors and not retried.
+    if concurrency < 1:
+        raise ValueError("concurrency must be positive")
+    if speed is not None and speed <= 0:
+        raise ValueError("speed must be positive")
+    import queue
+
+    todo: "queue.Queue[Optional[TxRecord]]" = queue.Queue()
+    for record in sorted(records, key=lambda r: r.start):
+        todo.put(record)
+    for _ in range(concurrency):
+        todo.put(None)
+    lock = threading.Lock()
+    latencies: Dict[LockMode, List[float]] = {}
+    errors: Dict[LockMode, int] = {}
+    epoch = time.monotonic()
+
+    def run(record: TxRecord) -> None:
+        with begin_pool(pool, record.lock_mode) as conn:
+            for sql, shape, values in record.statements:
+                bindings = _replay_bindings(shape, values)
+                cast(Any, conn.cursor()).execute(sql, bindings).fetchall()
+
+    def worker() -> None:
+        while True:
+            record = todo.get()
+            if record is None:
+                return
+            if speed is not None:
+                delay = epoch + record.start / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            start = time.monotonic()
+            try:
+                run(record)
+            except _errors():
+                with lock:
+                    errors[record.lock_mode] = errors.get(record.lock_mode, 0) + 1
+                continue
+            elapsed = time.monotonic() - start
+            with lock:
+                latencies.setdefault(record.lock_mode, []).append(elapsed)
+
+    threads = [
+        threading.Thread(target=worker, name="dbver-replay", daemon=True)
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - epoch
+    result = {}
+    for lock_mode in set(latencies) | set(errors):
+        ordered = sorted(latencies.get(lock_mode, ()))
+        result[lock_mode] = ReplayStats(
+            transactions=len(ordered),
+            errors=errors.get(lock_mode, 0),
+            throughput=len(ordered) / wall if wall > 0 else 0.0,
+            p50=_percentile(ordered, 0.5),
+            p95=_percentile(ordered, 0.95),
+            p99=_percentile(ordered, 0.99),
+        )
+    return result
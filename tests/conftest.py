@@ -26,26 +26,55 @@ except ImportError:
     apsw = None  # type: ignore
 
 
-def _conn_factory_sqlite() -> Callable[[], dbver.Connection]:
-    return functools.partial(sqlite3.connect, ":memory:", isolation_level=None)
+def _connect_sqlite(threaded: bool) -> Callable[[str], dbver.Connection]:
+    if threaded:
+        return functools.partial(
+            sqlite3.connect, isolation_level=None, check_same_thread=False
+        )
+    return functools.partial(sqlite3.connect, isolation_level=None)
 
 
-def _conn_factory_apsw() -> Callable[[], dbver.Connection]:
-    return functools.partial(apsw.Connection, ":memory:")
+def _connect_apsw(threaded: bool) -> Callable[[str], dbver.Connection]:
+    return apsw.Connection  # type: ignore
 
 
 @pytest.fixture(
     params=(
-        _conn_factory_sqlite,
+        _connect_sqlite,
         pytest.param(
-            _conn_factory_apsw,
+            _connect_apsw,
             marks=pytest.mark.skipif(not apsw, reason="apsw not used"),
         ),
     ),
     ids=("sqlite", "apsw"),
 )
-def conn_factory(request: pytest.FixtureRequest) -> Callable[[], dbver.Connection]:
-    return request.param()  # type: ignore
+def library(
+    request: pytest.FixtureRequest,
+) -> Callable[[bool], Callable[[str], dbver.Connection]]:
+    return request.param  # type: ignore
+
+
+@pytest.fixture
+def connect(
+    library: Callable[[bool], Callable[[str], dbver.Connection]]
+) -> Callable[[str], dbver.Connection]:
+    return library(False)
+
+
+# For connections used from more than one thread, as by pools shared between
+# threads
+@pytest.fixture
+def threaded_connect(
+    library: Callable[[bool], Callable[[str], dbver.Connection]]
+) -> Callable[[str], dbver.Connection]:
+    return library(True)
+
+
+@pytest.fixture
+def conn_factory(
+    connect: Callable[[str], dbver.Connection]
+) -> Callable[[], dbver.Connection]:
+    return functools.partial(connect, ":memory:")
 
 
 @pytest.fixture
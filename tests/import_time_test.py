@@ -0,0 +1,93 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import os
+import pathlib
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import dbver
+
+
+def _loaded_after_import() -> set:
+    code = "import sys, dbver; print('\\n'.join(sys.modules))"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    return set(out.splitlines())
+
+
+def test_import_defers_heavy_modules() -> None:
+    loaded = _loaded_after_import()
+    assert "dbver" in loaded
+    for name in (
+        "apsw",
+        "concurrent.futures",
+        "hashlib",
+        "heapq",
+        "json",
+        "pathlib",
+        "queue",
+        "urllib.parse",
+    ):
+        assert name not in loaded
+
+
+# Generous, so slow machines don't fail, but catches import-time work such as
+# importing a heavy module or running queries. Measured at about 9ms.
+IMPORT_BUDGET_US = 30000
+
+
+def _import_self_time(tmp_path: pathlib.Path) -> int:
+    # dbver's own import time in microseconds, not counting its imports, with
+    # bytecode already compiled
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(sys.path),
+        PYTHONPYCACHEPREFIX=str(tmp_path),
+    )
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import dbver"],
+        env=env,
+        check=True,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    ).stderr
+    for line in err.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "dbver":
+            return int(fields[0].split(":")[1])
+    raise AssertionError(err)  # pragma: no cover
+
+
+def test_import_time(tmp_path: pathlib.Path) -> None:
+    times = [_import_self_time(tmp_path) for _ in range(4)]
+    # the first run compiles
+    assert min(times[1:]) < IMPORT_BUDGET_US
+
+
+def test_errors_includes_apsw_once_imported() -> None:
+    apsw = pytest.importorskip("apsw")
+    assert apsw.Error in dbver.Errors
+    assert sqlite3.Error in dbver.Errors
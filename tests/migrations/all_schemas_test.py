@@ -0,0 +1,86 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+
+@MIGRATIONS.migrates(0, 1000000)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key)')
+
+
+@MIGRATIONS.migrates(1000000, 1001000)
+def migrate_1dot1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'alter table "{schema}".a add column t text')
+
+
+@pytest.fixture
+def attached(conn: dbver.Connection) -> dbver.Connection:
+    for name in ("a", "other schema"):
+        conn.cursor().execute("attach ':memory:' as ?", (name,))
+    return conn
+
+
+def test_get_schemas(attached: dbver.Connection) -> None:
+    assert dbver.get_schemas(attached) == ["main", "a", "other schema"]
+
+
+def test_has_tables_all(attached: dbver.Connection) -> None:
+    attached.cursor().execute('create table "other schema".x (x int)')
+    assert dbver.has_tables_all(attached, ["main", "a", "other schema"]) == {
+        "main": False,
+        "a": False,
+        "other schema": True,
+    }
+    assert dbver.has_tables_all(attached, []) == {}
+    with pytest.raises(ValueError):
+        dbver.has_tables_all(attached, ['in"valid'])
+
+
+def test_upgrade_all(attached: dbver.Connection) -> None:
+    MIGRATIONS[0][1000000](attached, "a")
+    with dbver.begin(attached, dbver.IMMEDIATE):
+        result = MIGRATIONS.upgrade_all(attached)
+    assert result == {"main": 1001000, "a": 1001000, "other schema": 1001000}
+    assert MIGRATIONS.get_format_all(attached) == result
+
+
+def test_upgrade_some(attached: dbver.Connection) -> None:
+    result = MIGRATIONS.upgrade_all(attached, ["a"])
+    assert result == {"a": 1001000}
+    assert MIGRATIONS.get_format_all(attached) == {
+        "main": 0,
+        "a": 1001000,
+        "other schema": 0,
+    }
+
+
+def test_check_all_nonempty(attached: dbver.Connection) -> None:
+    attached.cursor().execute('create table "other schema".x (x int)')
+    with pytest.raises(dbver.VersionError, match="other schema"):
+        MIGRATIONS.check_all(attached)
+    with pytest.raises(dbver.VersionError):
+        MIGRATIONS.upgrade_all(attached)
+    # nothing was migrated
+    assert MIGRATIONS.get_format_all(attached, ["main", "a"]) == {"main": 0, "a": 0}
+
+
+def test_check_all_wrong_application_id(attached: dbver.Connection) -> None:
+    attached.cursor().execute('pragma "a".application_id = 2')
+    with pytest.raises(dbver.VersionError, match="application_id"):
+        MIGRATIONS.check_all(attached)
@@ -0,0 +1,150 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+from typing import Tuple
+
+import pytest
+
+import dbver
+
+
+@pytest.fixture(params=("main", "other schema"))
+def schema(conn: dbver.Connection, request: pytest.FixtureRequest) -> str:
+    if request.param != "main":
+        conn.cursor().execute("attach ':memory:' as ?", (request.param,))
+    cur = conn.cursor()
+    cur.execute(f'create table "{request.param}".a (a int primary key, t text)')
+    for i in range(10):
+        cur.execute(
+            f'insert into "{request.param}".a (a, t) values (?, ?)', (i, str(i))
+        )
+    return request.param  # type: ignore
+
+
+def select_all(conn: dbver.Connection, sql: str) -> list:
+    return list(conn.cursor().execute(sql))  # type: ignore
+
+
+def test_insert_select(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".b (b int primary key, u text)')
+    count = dbver.copy_rows(
+        conn, "a", "b", schema, columns={"b": "a * 2", "u": "t || 'x'"}
+    )
+    assert count == 10
+    rows = select_all(conn, f'select * from "{schema}".b order by b')
+    assert rows == [(i * 2, f"{i}x") for i in range(10)]
+
+
+def test_transform(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".b (b int primary key, u text)')
+
+    def transform(row: Tuple) -> Tuple:
+        a, t = row
+        return (a + 100, t.upper() + "!")
+
+    count = dbver.copy_rows(conn, "a", "b", schema, transform=transform, batch_size=3)
+    assert count == 10
+    rows = select_all(conn, f'select * from "{schema}".b order by b')
+    assert rows == [(i + 100, f"{i}!") for i in range(10)]
+
+
+def test_transform_empty(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'delete from "{schema}".a')
+    conn.cursor().execute(f'create table "{schema}".b (b int primary key, u text)')
+    assert dbver.copy_rows(conn, "a", "b", schema, transform=tuple) == 0
+
+
+def test_rebuild_table(conn: dbver.Connection, schema: str) -> None:
+    count = dbver.rebuild_table(
+        conn,
+        "a",
+        "a int primary key, t text not null, n int not null default 0",
+        schema,
+        columns={"a": "a", "t": "t", "n": "length(t)"},
+    )
+    assert count == 10
+    rows = select_all(conn, f'select a, t, n from "{schema}".a order by a')
+    assert rows == [(i, str(i), 1) for i in range(10)]
+    names = select_all(conn, f'select name from "{schema}".sqlite_master')
+    assert ("a",) in names
+    assert ("_dbver_new_a",) not in names
+
+
+def test_invalid_names(conn: dbver.Connection) -> None:
+    with pytest.raises(ValueError):
+        dbver.copy_rows(conn, 'in"valid', "b")
+    with pytest.raises(ValueError):
+        dbver.copy_rows(conn, "a", "b", columns={'in"valid': "a"})
+    with pytest.raises(TypeError):
+        dbver.rebuild_table(conn, 1, "a int")  # type: ignore
+
+
+def test_rebuild_keeps_indexes_triggers_views(
+    conn: dbver.Connection, schema: str
+) -> None:
+    cur = conn.cursor()
+    cur.execute(f'create unique index "{schema}".a_t on a (t)')
+    cur.execute(f'create table "{schema}".log (a int)')
+    cur.execute(
+        f'create trigger "{schema}".a_log after insert on a '
+        "begin insert into log (a) values (new.a); end"
+    )
+    cur.execute(f'create view "{schema}".v as select a, t from a')
+    dbver.rebuild_table(
+        conn,
+        "a",
+        "a int primary key, t text, n int",
+        schema,
+        columns={"a": "a", "t": "t"},
+    )
+    names = select_all(
+        conn, f'select type, name from "{schema}".sqlite_master order by name'
+    )
+    assert ("index", "a_t") in names
+    assert ("trigger", "a_log") in names
+    assert ("view", "v") in names
+    cur.execute(f"insert into \"{schema}\".a (a, t) values (100, 'x')")
+    assert select_all(conn, f'select a from "{schema}".log') == [(100,)]
+    with pytest.raises(dbver.Errors):
+        cur.execute(f"insert into \"{schema}\".a (a, t) values (101, 'x')")
+    assert len(select_all(conn, f'select * from "{schema}".v')) == 11
+
+
+def test_rebuild_requires_foreign_keys_off(conn: dbver.Connection) -> None:
+    cur = conn.cursor()
+    cur.execute("create table p (id integer primary key)")
+    cur.execute("create table c (p int references p (id) on delete cascade)")
+    cur.execute("insert into p (id) values (1)")
+    cur.execute("insert into c (p) values (1), (1)")
+    cur.execute("pragma foreign_keys = on")
+    with pytest.raises(dbver.Error):
+        dbver.rebuild_table(conn, "p", "id integer primary key")
+    cur.execute("pragma foreign_keys = off")
+    dbver.rebuild_table(
+        conn, "p", "id integer primary key, x text", columns={"id": "id"}
+    )
+    assert select_all(conn, "select count(*) from c") == [(2,)]
+
+
+def test_rebuild_checks_foreign_keys(conn: dbver.Connection) -> None:
+    cur = conn.cursor()
+    cur.execute("create table p (id integer primary key)")
+    cur.execute("create table c (p int references p (id))")
+    cur.execute("insert into p (id) values (1), (2)")
+    cur.execute("insert into c (p) values (2)")
+    with pytest.raises(dbver.IntegrityError) as exc_info:
+        dbver.rebuild_table(
+            conn, "p", "id integer primary key", columns={"id": "id - 1"}
+        )
+    assert [p.table for p in exc_info.value.problems] == ["c"]
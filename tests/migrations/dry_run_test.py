@@ -0,0 +1,94 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+from typing import Callable
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+
+@MIGRATIONS.migrates(0, 1000000)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key, t text)')
+
+
+@MIGRATIONS.migrates(1000000, 1001000)
+def migrate_1dot1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'alter table "{schema}".a add column n int')
+
+
+@MIGRATIONS.migrates(1001000, 1002000)
+def migrate_1dot2(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'update "{schema}".a set n = length(t)')
+
+
+@pytest.fixture(params=("main", "other schema"))
+def schema(conn: dbver.Connection, request: pytest.FixtureRequest) -> str:
+    if request.param != "main":
+        conn.cursor().execute("attach ':memory:' as ?", (request.param,))
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        MIGRATIONS[0][1000000](conn, request.param)
+        cur = conn.cursor()
+        for i in range(2000):
+            cur.execute(
+                f'insert into "{request.param}".a (a, t) values (?, ?)', (i, "x" * 50)
+            )
+    return request.param  # type: ignore
+
+
+def test_plan(conn: dbver.Connection, schema: str) -> None:
+    assert MIGRATIONS.plan(conn, schema) == [
+        (1000000, 1001000),
+        (1001000, 1002000),
+    ]
+    assert MIGRATIONS.plan(conn, schema, condition=lambda o, n: n < 1002000) == [
+        (1000000, 1001000)
+    ]
+
+
+def test_dry_run(
+    conn: dbver.Connection, connect: Callable[[str], dbver.Connection], schema: str
+) -> None:
+    result = MIGRATIONS.dry_run(conn, connect, schema)
+    assert [(e.from_format, e.to_format) for e in result] == [
+        (1000000, 1001000),
+        (1001000, 1002000),
+    ]
+    for entry in result:
+        assert entry.duration >= 0
+        assert entry.estimate == pytest.approx(entry.duration)
+    # the original is untouched
+    assert MIGRATIONS.get_format(conn, schema) == 1000000
+
+
+def test_dry_run_sample(
+    conn: dbver.Connection, connect: Callable[[str], dbver.Connection], schema: str
+) -> None:
+    result = MIGRATIONS.dry_run(conn, connect, schema, sample=0.1)
+    assert len(result) == 2
+    for entry in result:
+        assert entry.estimate > entry.duration * 2
+    cur = conn.cursor()
+    cur.execute(f'select count(*) from "{schema}".a')
+    assert cur.fetchone() == (2000,)
+
+
+def test_invalid_sample(
+    conn: dbver.Connection, connect: Callable[[str], dbver.Connection]
+) -> None:
+    with pytest.raises(ValueError):
+        MIGRATIONS.dry_run(conn, connect, sample=0)
@@ -0,0 +1,168 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import pathlib
+from typing import Any
+from typing import Callable
+from typing import List
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.UserVersionMigrations[dbver.Connection](fingerprints=True)
+
+
+@MIGRATIONS.migrates(0, 1)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key)')
+
+
+@MIGRATIONS.migrates(1, 2)
+def migrate_2(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create index "{schema}".a_a on a (a desc)')
+
+
+def test_fingerprint(conn: dbver.Connection) -> None:
+    empty = dbver.schema_fingerprint(conn)
+    conn.cursor().execute("create table t (a int,\n  b   text)")
+    created = dbver.schema_fingerprint(conn)
+    assert created != empty
+    # sqlite's and dbver's own tables are ignored
+    conn.cursor().execute("create table _dbver_other (a int)")
+    conn.cursor().execute("insert into t (a) values (1)")
+    conn.cursor().execute("analyze")
+    assert dbver.schema_fingerprint(conn) == created
+
+
+def test_whitespace_ignored(conn_factory: Callable[[], dbver.Connection]) -> None:
+    conn1 = conn_factory()
+    conn2 = conn_factory()
+    try:
+        conn1.cursor().execute("create table t (a int, b text)")
+        conn2.cursor().execute("create table t (a int,\n    b   text)")
+        assert dbver.schema_fingerprint(conn1) == dbver.schema_fingerprint(conn2)
+    finally:
+        conn1.close()
+        conn2.close()
+
+
+def test_cache(
+    tmp_path: pathlib.Path,
+    connect: Callable[[str], dbver.Connection],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    computed: List[str] = []
+    schema_fingerprint = dbver.schema_fingerprint
+
+    def counting(conn: dbver.Connection, schema: str = "main") -> str:
+        computed.append(schema)
+        return schema_fingerprint(conn, schema=schema)
+
+    monkeypatch.setattr(dbver, "schema_fingerprint", counting)
+    cache = dbver.FingerprintCache()
+    conn = connect(str(tmp_path / "db"))
+    other = connect(str(tmp_path / "db"))
+    try:
+        first = cache.get(conn)
+        assert cache.get(conn) == cache.get(other) == first
+        assert len(computed) == 1
+        other.cursor().execute("create table t (a int)")
+        second = cache.get(conn)
+        assert second != first
+        assert len(computed) == 2
+    finally:
+        conn.close()
+        other.close()
+
+
+def test_cache_skips_memory(
+    conn: dbver.Connection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    computed: List[Any] = []
+    schema_fingerprint = dbver.schema_fingerprint
+
+    def counting(conn: dbver.Connection, schema: str = "main") -> str:
+        computed.append(schema)
+        return schema_fingerprint(conn, schema=schema)
+
+    monkeypatch.setattr(dbver, "schema_fingerprint", counting)
+    cache = dbver.FingerprintCache()
+    cache.get(conn)
+    cache.get(conn)
+    assert len(computed) == 2
+
+
+def test_recorded_drift(conn: dbver.Connection) -> None:
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        assert MIGRATIONS.upgrade(conn, breaking=True) == 2
+    MIGRATIONS.check_fingerprint(conn)
+    conn.cursor().execute("create table extra (a int)")
+    with pytest.raises(dbver.VersionError):
+        MIGRATIONS.check_fingerprint(conn)
+    conn.cursor().execute("drop table extra")
+    MIGRATIONS.check_fingerprint(conn)
+    conn.cursor().execute("drop index a_a")
+    with pytest.raises(dbver.VersionError):
+        MIGRATIONS.check_fingerprint(conn)
+
+
+def test_nothing_expected(conn: dbver.Connection) -> None:
+    MIGRATIONS.check_fingerprint(conn)
+    MIGRATIONS.check_fingerprint(conn, expected={1: "x"})
+    with pytest.raises(dbver.VersionError):
+        MIGRATIONS.check_fingerprint(conn, expected={0: "x"})
+
+
+def test_build_fingerprints(
+    conn: dbver.Connection, connect: Callable[[str], dbver.Connection]
+) -> None:
+    expected = MIGRATIONS.build_fingerprints(connect)
+    assert set(expected) == {0, 1, 2}
+    assert len(set(expected.values())) == 3
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        MIGRATIONS.upgrade(conn, breaking=True)
+    assert MIGRATIONS.get_fingerprint(conn) == expected[2]
+    MIGRATIONS.check_fingerprint(conn, expected=expected)
+    conn.cursor().execute("create table extra (a int)")
+    with pytest.raises(dbver.VersionError):
+        MIGRATIONS.check_fingerprint(conn, expected=expected)
+
+
+COMPAT = dbver.SemverMigrations[dbver.Connection](fingerprints=True)
+
+
+@COMPAT.migrates(0, 1000000)
+def compat_1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key)')
+
+
+@COMPAT.migrates_compat(1000000, 2000000, views={"a": "select id as a from b"})
+def compat_2(conn: dbver.Connection, schema: str) -> None:
+    cur = conn.cursor()
+    cur.execute(f'create table "{schema}".b (id int primary key)')
+    cur.execute(f'drop table "{schema}".a')
+
+
+def test_compat_ignored(
+    conn: dbver.Connection, connect: Callable[[str], dbver.Connection]
+) -> None:
+    expected = COMPAT.build_fingerprints(connect)
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        COMPAT.upgrade(conn, breaking=True)
+    COMPAT.check_fingerprint(conn)
+    COMPAT.check_fingerprint(conn, expected=expected)
+    assert dbver.retire_compat(conn, force=True) == 1
+    COMPAT.check_fingerprint(conn)
+    COMPAT.check_fingerprint(conn, expected=expected)
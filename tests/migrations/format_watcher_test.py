@@ -0,0 +1,127 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import pathlib
+import sqlite3
+import threading
+from typing import Callable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+
+@MIGRATIONS.migrates(0, 1000000)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key)')
+
+
+@MIGRATIONS.migrates(1000000, 1001000)
+def migrate_1dot1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'alter table "{schema}".a add column t text')
+
+
+@pytest.fixture
+def path(tmp_path: pathlib.Path) -> str:
+    return str(tmp_path / "db")
+
+
+@pytest.fixture
+def writer(
+    path: str, connect: Callable[[str], dbver.Connection]
+) -> Iterator[dbver.Connection]:
+    conn = connect(path)
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        MIGRATIONS[0][1000000](conn, "main")
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def watcher(
+    path: str,
+    threaded_connect: Callable[[str], dbver.Connection],
+    writer: dbver.Connection,
+) -> Iterator[dbver.FormatWatcher[int, dbver.Connection]]:
+    conn = threaded_connect(path)
+    yield dbver.FormatWatcher(MIGRATIONS, conn, interval=0.01)
+    conn.close()
+
+
+def test_poll(
+    writer: dbver.Connection, watcher: dbver.FormatWatcher[int, dbver.Connection]
+) -> None:
+    changes: List[Tuple[int, int]] = []
+    watcher.add_callback(lambda old, new: changes.append((old, new)))
+    assert watcher.format == 1000000
+    assert not watcher.poll()
+
+    # a commit which doesn't change the format
+    with dbver.begin(writer, dbver.IMMEDIATE):
+        writer.cursor().execute("insert into a (a) values (1)")
+    assert not watcher.poll()
+
+    with dbver.begin(writer, dbver.IMMEDIATE):
+        MIGRATIONS.upgrade(writer)
+    assert watcher.poll()
+    assert watcher.format == 1001000
+    assert changes == [(1000000, 1001000)]
+    assert not watcher.poll()
+
+
+def test_remove_callback(
+    writer: dbver.Connection, watcher: dbver.FormatWatcher[int, dbver.Connection]
+) -> None:
+    changes: List[Tuple[int, int]] = []
+
+    def callback(old: int, new: int) -> None:
+        changes.append((old, new))  # pragma: no cover
+
+    watcher.add_callback(callback)
+    watcher.remove_callback(callback)
+    with dbver.begin(writer, dbver.IMMEDIATE):
+        MIGRATIONS.upgrade(writer)
+    assert watcher.poll()
+    assert changes == []
+
+
+def test_background(
+    writer: dbver.Connection, watcher: dbver.FormatWatcher[int, dbver.Connection]
+) -> None:
+    changed = threading.Event()
+    watcher.add_callback(lambda old, new: changed.set())
+    watcher.start()
+    try:
+        with dbver.begin(writer, dbver.IMMEDIATE):
+            MIGRATIONS.upgrade(writer)
+        assert changed.wait(5)
+    finally:
+        watcher.stop()
+
+
+def test_thread_bound(path: str, writer: dbver.Connection) -> None:
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        watcher = dbver.FormatWatcher(MIGRATIONS, conn)
+        with pytest.raises(ValueError):
+            watcher.start()
+        # still usable on its own thread
+        assert not watcher.poll()
+    finally:
+        conn.close()
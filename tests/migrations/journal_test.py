@@ -0,0 +1,82 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import time
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1, journal=True)
+
+
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    cur = conn.cursor()
+    cur.execute(f'create table "{schema}".a (a int primary key)')
+    for i in range(3):
+        cur.execute(f'insert into "{schema}".a (a) values (?)', (i,))
+
+
+MIGRATIONS.add(0, 1000000, migrate_1)
+
+
+@MIGRATIONS.migrates(1000000, 1001000)
+def migrate_1dot1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'update "{schema}".a set a = a + 10')
+
+
+class DummyException(Exception):
+    pass
+
+
+def test_journal(conn: dbver.Connection) -> None:
+    assert dbver.get_journal(conn) == []
+    start = time.time()
+    MIGRATIONS.upgrade(conn)
+    journal = dbver.get_journal(conn)
+    assert [(e.from_format, e.to_format, e.changes) for e in journal] == [
+        (0, 1000000, 3),
+        (1000000, 1001000, 3),
+    ]
+    for entry in journal:
+        assert start <= entry.started <= time.time()
+        assert entry.duration >= 0
+
+
+def test_other_schema(conn: dbver.Connection) -> None:
+    conn.cursor().execute("attach ':memory:' as ?", ("other schema",))
+    MIGRATIONS.upgrade(conn, "other schema")
+    assert len(dbver.get_journal(conn, "other schema")) == 2
+    assert dbver.get_journal(conn) == []
+
+
+def test_rollback(conn: dbver.Connection) -> None:
+    migrations = dbver.SemverMigrations[dbver.Connection](journal=True)
+    migrations.add(0, 1000000, migrate_1)
+
+    @migrations.migrates(1000000, 1001000)
+    def migrate_fail(conn: dbver.Connection, schema: str) -> None:
+        raise DummyException()
+
+    with pytest.raises(DummyException):
+        with dbver.begin(conn, dbver.IMMEDIATE):
+            migrations.upgrade(conn)
+    assert dbver.get_journal(conn) == []
+
+
+def test_disabled(conn: dbver.Connection) -> None:
+    migrations = dbver.SemverMigrations[dbver.Connection]()
+    migrations.add(0, 1000000, migrate_1)
+    migrations.upgrade(conn)
+    assert dbver.get_journal(conn) == []
@@ -0,0 +1,119 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import pathlib
+from typing import Callable
+from typing import Iterator
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection]()
+
+
+@pytest.fixture
+def pool(
+    tmp_path: pathlib.Path, connect: Callable[[str], dbver.Connection]
+) -> Iterator[dbver.ReusePool[dbver.Connection]]:
+    pool = dbver.ReusePool(functools.partial(connect, str(tmp_path / "db")))
+    yield pool
+    pool.close_all()
+
+
+def test_coalesced(pool: dbver.Pool[dbver.Connection]) -> None:
+    registry = dbver.ReaderRegistry(interval=3600)
+    assert not registry.due()
+    assert registry.flush_pool(pool) == 0
+    for i in range(100):
+        registry.seen("app", 1000000, 1002000, now=float(i))
+    registry.seen("old", 0, 0, now=5.0)
+    assert registry.due()
+    assert registry.flush_pool(pool) == 2
+    with dbver.begin_pool(pool, dbver.DEFERRED) as conn:
+        assert dbver.get_readers(conn) == [
+            dbver.ReaderRecord("app", 1000000, 1002000, 99.0),
+            dbver.ReaderRecord("old", 0, 0, 5.0),
+        ]
+    # within the interval, nothing is written
+    registry.seen("app", 1000000, 1002000, now=200.0)
+    assert not registry.due()
+    assert registry.flush_pool(pool) == 0
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        assert registry.flush(conn) == 0
+        assert registry.flush(conn, force=True) == 1
+        assert dbver.get_readers(conn)[0].last_seen == 200.0
+
+
+def test_last_seen_never_decreases(pool: dbver.Pool[dbver.Connection]) -> None:
+    registry1 = dbver.ReaderRegistry(interval=0)
+    registry2 = dbver.ReaderRegistry(interval=0)
+    registry1.seen("app", 1, 2, now=10.0)
+    registry2.seen("app", 1, 3, now=5.0)
+    registry1.flush_pool(pool)
+    registry2.flush_pool(pool)
+    with dbver.begin_pool(pool, dbver.DEFERRED) as conn:
+        assert dbver.get_readers(conn) == [dbver.ReaderRecord("app", 1, 3, 10.0)]
+
+
+def test_no_table(conn: dbver.Connection) -> None:
+    assert dbver.get_readers(conn) == []
+    assert MIGRATIONS.blocking_readers(2000000, conn) == []
+
+
+def test_invalid(conn: dbver.Connection) -> None:
+    with pytest.raises(ValueError):
+        dbver.ReaderRegistry('invalid"schema')
+    registry = dbver.ReaderRegistry()
+    with pytest.raises(ValueError):
+        registry.seen("app", 0, 1 << 31)
+
+
+def test_blocking_readers(conn: dbver.Connection) -> None:
+    registry = dbver.ReaderRegistry()
+    registry.seen("v1.0", 1000000, 1000000, now=10.0)
+    registry.seen("v1.0-1.5", 1000000, 1005000, now=10.0)
+    registry.seen("v1.2-2.1", 1002000, 2001000, now=20.0)
+    registry.seen("v2.3", 2003000, 2003000, now=30.0)
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        registry.flush(conn)
+
+    def names(to_format: int, since: float = None) -> list:
+        readers = MIGRATIONS.blocking_readers(to_format, conn, since=since)
+        return [reader.name for reader in readers]
+
+    assert names(1003000) == ["v2.3"]
+    assert names(2000000) == ["v1.0", "v1.0-1.5", "v2.3"]
+    assert names(2003000) == ["v1.0", "v1.0-1.5"]
+    assert names(2003000, since=15.0) == []
+    assert names(3000000) == ["v1.0", "v1.0-1.5", "v1.2-2.1", "v2.3"]
+
+
+def test_flush_before_provisioning(pool: dbver.Pool[dbver.Connection]) -> None:
+    migrations = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+    @migrations.migrates(0, 1000000)
+    def migrate_1(conn: dbver.Connection, schema: str) -> None:
+        conn.cursor().execute(f'create table "{schema}".a (a int)')
+
+    registry = dbver.ReaderRegistry()
+    registry.seen("app", 1000000, 1000000)
+    assert registry.flush_pool(pool) == 1
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        assert not dbver.has_tables(conn)
+        assert dbver.has_tables_all(conn, ["main"]) == {"main": False}
+        assert migrations.upgrade(conn) == 1000000
+        assert dbver.has_tables(conn)
+        assert len(dbver.get_readers(conn)) == 1
@@ -0,0 +1,111 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+
+@MIGRATIONS.migrates(0, 1000000)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key, t text)')
+
+
+@MIGRATIONS.migrates_compat(
+    1000000,
+    2000000,
+    views={"a": "select id as a, text as t from b"},
+    triggers={
+        "a_insert": "instead of insert on a begin "
+        "insert into b (id, text) values (new.a, new.t); end"
+    },
+    grace=60,
+)
+def migrate_2(conn: dbver.Connection, schema: str) -> None:
+    cur = conn.cursor()
+    cur.execute(f'create table "{schema}".b (id int primary key, text text)')
+    cur.execute(f'insert into "{schema}".b select * from "{schema}".a')
+    cur.execute(f'drop table "{schema}".a')
+
+
+@pytest.fixture(params=("main", "other schema"))
+def schema(conn: dbver.Connection, request: pytest.FixtureRequest) -> str:
+    if request.param != "main":
+        conn.cursor().execute("attach ':memory:' as ?", (request.param,))
+    MIGRATIONS[0][1000000](conn, request.param)
+    conn.cursor().execute(f"insert into \"{request.param}\".a values (1, 'x')")
+    return request.param  # type: ignore
+
+
+def select_all(conn: dbver.Connection, sql: str) -> list:
+    return list(conn.cursor().execute(sql))  # type: ignore
+
+
+def test_compat(conn: dbver.Connection, schema: str) -> None:
+    assert not MIGRATIONS.is_compatible(2000000, conn, schema)
+    assert dbver.get_compat_formats(conn, schema) == set()
+
+    assert MIGRATIONS.upgrade(conn, schema, breaking=True) == 2000000
+
+    assert MIGRATIONS.is_compatible(1000000, conn, schema)
+    assert not MIGRATIONS.is_compatible(1001000, conn, schema)
+    assert MIGRATIONS.is_compatible(2000000, conn, schema)
+    assert dbver.get_compat_formats(conn, schema) == {1000000}
+    # old writer
+    conn.cursor().execute(f"insert into \"{schema}\".a (a, t) values (2, 'y')")
+    # old reader
+    assert select_all(conn, f'select * from "{schema}".a order by a') == [
+        (1, "x"),
+        (2, "y"),
+    ]
+    # new reader
+    assert select_all(conn, f'select * from "{schema}".b order by id') == [
+        (1, "x"),
+        (2, "y"),
+    ]
+
+
+def test_retire(conn: dbver.Connection, schema: str) -> None:
+    MIGRATIONS.upgrade(conn, schema, breaking=True)
+
+    assert dbver.retire_compat(conn, schema) == 0
+    assert MIGRATIONS.is_compatible(1000000, conn, schema)
+    assert dbver.retire_compat(conn, schema, now=2**40) == 2
+    assert not MIGRATIONS.is_compatible(1000000, conn, schema)
+    assert dbver.get_compat_formats(conn, schema) == set()
+    with pytest.raises(dbver.Errors):
+        conn.cursor().execute(f'select * from "{schema}".a')
+
+
+def test_retire_force(conn: dbver.Connection, schema: str) -> None:
+    dbver.publish_compat(
+        conn, 1000000, schema, views={"v": "select * from a"}, expires=None
+    )
+    assert dbver.retire_compat(conn, schema, now=2**40) == 0
+    assert dbver.retire_compat(conn, schema, force=True) == 1
+    with pytest.raises(dbver.Errors):
+        conn.cursor().execute(f'select * from "{schema}".v')
+
+
+def test_invalid_name(conn: dbver.Connection) -> None:
+    with pytest.raises(ValueError):
+        dbver.publish_compat(conn, 1000000, views={'in"valid': "select 1"})
+
+
+def test_retire_unprovisioned(conn: dbver.Connection) -> None:
+    assert dbver.retire_compat(conn, force=True) == 0
+    assert not dbver.has_tables(conn)
+    assert select_all(conn, "select name from sqlite_master") == []
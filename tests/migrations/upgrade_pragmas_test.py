@@ -0,0 +1,133 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import pathlib
+from typing import Any
+from typing import Callable
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+
+def get_pragma(conn: dbver.Connection, name: str) -> Any:
+    cur = conn.cursor()
+    cur.execute(f"pragma {name}")
+    return cur.fetchone()[0]
+
+
+@MIGRATIONS.migrates(0, 1000000)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    assert get_pragma(conn, f'"{schema}".cache_size') == -12345
+    assert get_pragma(conn, "temp_store") == 2
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key)')
+
+
+class DummyException(Exception):
+    pass
+
+
+PRAGMAS: dbver.Pragmas = {"cache_size": -12345, "temp_store": "memory"}
+
+
+def test_upgrade(conn: dbver.Connection) -> None:
+    cache_size = get_pragma(conn, "cache_size")
+    temp_store = get_pragma(conn, "temp_store")
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        assert MIGRATIONS.upgrade(conn, pragmas=PRAGMAS) == 1000000
+    assert get_pragma(conn, "cache_size") == cache_size
+    assert get_pragma(conn, "temp_store") == temp_store
+
+
+def test_upgrade_other_schema(conn: dbver.Connection) -> None:
+    conn.cursor().execute("attach ':memory:' as ?", ("other schema",))
+    cache_size = get_pragma(conn, '"other schema".cache_size')
+    MIGRATIONS.upgrade(conn, "other schema", pragmas=PRAGMAS)
+    assert get_pragma(conn, '"other schema".cache_size') == cache_size
+
+
+def test_upgrade_failure(conn: dbver.Connection) -> None:
+    migrations = dbver.SemverMigrations[dbver.Connection]()
+
+    @migrations.migrates(0, 1000000)
+    def migrate_fail(conn: dbver.Connection, schema: str) -> None:
+        assert get_pragma(conn, "cache_size") == -12345
+        raise DummyException()
+
+    cache_size = get_pragma(conn, "cache_size")
+    with pytest.raises(DummyException):
+        migrations.upgrade(conn, pragmas=PRAGMAS)
+    assert get_pragma(conn, "cache_size") == cache_size
+
+
+def test_scope_around_transaction(
+    tmp_path: pathlib.Path, connect: Callable[[str], dbver.Connection]
+) -> None:
+    conn = connect(str(tmp_path / "db"))
+    try:
+        conn.cursor().execute("pragma journal_mode = wal")
+        with dbver.pragma_scope(conn, dbver.BULK_LOAD_PRAGMAS, checkpoint=True):
+            assert get_pragma(conn, "synchronous") == 0
+            with dbver.begin(conn, dbver.IMMEDIATE):
+                MIGRATIONS.upgrade(conn, pragmas=PRAGMAS)
+        assert get_pragma(conn, "synchronous") == 2
+        # truncated by the checkpoint
+        assert (tmp_path / "db-wal").stat().st_size == 0
+    finally:
+        conn.close()
+
+
+def test_upgrade_in_transaction(
+    tmp_path: pathlib.Path, connect: Callable[[str], dbver.Connection]
+) -> None:
+    migrations = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+    @migrations.migrates(0, 1000000)
+    def migrate_bulk(conn: dbver.Connection, schema: str) -> None:
+        assert get_pragma(conn, "synchronous") == 0
+        assert get_pragma(conn, "cache_size") == -1000000
+        conn.cursor().execute(f'create table "{schema}".a (a int primary key)')
+
+    conn = connect(str(tmp_path / "db"))
+    try:
+        conn.cursor().execute("pragma journal_mode = wal")
+        assert (
+            migrations.upgrade_in_transaction(
+                conn, pragmas=dbver.BULK_LOAD_PRAGMAS, checkpoint=True
+            )
+            == 1000000
+        )
+        assert get_pragma(conn, "synchronous") == 2
+        assert (tmp_path / "db-wal").stat().st_size == 0
+        assert migrations.get_format(conn) == 1000000
+    finally:
+        conn.close()
+
+
+def test_non_transactional_rejected(conn: dbver.Connection) -> None:
+    for pragmas in (dbver.BULK_LOAD_PRAGMAS, {"journal_mode": "wal"}):
+        with pytest.raises(ValueError):
+            with dbver.begin(conn, dbver.IMMEDIATE):
+                MIGRATIONS.upgrade(conn, pragmas=pragmas)
+    assert MIGRATIONS.get_format(conn) == 0
+
+
+def test_invalid(conn: dbver.Connection) -> None:
+    with pytest.raises(ValueError):
+        MIGRATIONS.upgrade(conn, pragmas={"cache_size": "1; drop table a"})
+    with pytest.raises(ValueError):
+        with dbver.pragma_scope(conn, {"x y": 1}):
+            pass  # pragma: no cover
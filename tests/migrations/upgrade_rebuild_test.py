@@ -0,0 +1,135 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import os
+import pathlib
+from typing import Callable
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+
+@MIGRATIONS.migrates(0, 1000000)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key, t text)')
+
+
+@MIGRATIONS.migrates(1000000, 2000000)
+def migrate_2(conn: dbver.Connection, schema: str) -> None:
+    dbver.rebuild_table(
+        conn,
+        "a",
+        "a int primary key, t text, n int",
+        schema,
+        columns={"a": "a", "t": "t", "n": "length(t)"},
+    )
+
+
+class DummyException(Exception):
+    pass
+
+
+@pytest.fixture
+def path(tmp_path: pathlib.Path, connect: Callable[[str], dbver.Connection]) -> str:
+    path = str(tmp_path / "db")
+    conn = connect(path)
+    try:
+        with dbver.begin(conn, dbver.IMMEDIATE):
+            MIGRATIONS[0][1000000](conn, "main")
+            cur = conn.cursor()
+            for i in range(1000):
+                cur.execute("insert into a (a, t) values (?, ?)", (i, "x" * 100))
+            cur.execute("delete from a where a >= 500")
+    finally:
+        conn.close()
+    return path
+
+
+def select_all(conn: dbver.Connection, sql: str) -> list:
+    return list(conn.cursor().execute(sql))  # type: ignore
+
+
+@pytest.mark.parametrize("journal_mode", ("delete", "wal"))
+def test_rebuild(
+    path: str, connect: Callable[[str], dbver.Connection], journal_mode: str
+) -> None:
+    conn = connect(path)
+    conn.cursor().execute(f"pragma journal_mode = {journal_mode}")
+    conn.close()
+    size = os.path.getsize(path)
+
+    assert MIGRATIONS.upgrade_rebuild(path, connect, breaking=True) == 2000000
+
+    assert os.path.getsize(path) < size
+    assert not os.path.exists(f"{path}-dbver-rebuild")
+    conn = connect(path)
+    try:
+        assert MIGRATIONS.get_format(conn) == 2000000
+        assert select_all(conn, "pragma journal_mode") == [(journal_mode,)]
+        assert select_all(conn, "select count(*), sum(n) from a") == [(500, 50000)]
+    finally:
+        conn.close()
+
+
+def test_noop(path: str, connect: Callable[[str], dbver.Connection]) -> None:
+    stat = os.stat(path)
+    assert MIGRATIONS.upgrade_rebuild(path, connect) == 1000000
+    assert os.stat(path).st_ino == stat.st_ino
+
+
+@pytest.mark.parametrize("journal_mode", ("delete", "wal"))
+def test_failure(
+    path: str, connect: Callable[[str], dbver.Connection], journal_mode: str
+) -> None:
+    conn = connect(path)
+    conn.cursor().execute(f"pragma journal_mode = {journal_mode}")
+    conn.close()
+    migrations = dbver.SemverMigrations[dbver.Connection](application_id=1)
+    migrations.add(0, 1000000, migrate_1)
+
+    @migrations.migrates(1000000, 1001000)
+    def migrate_fail(conn: dbver.Connection, schema: str) -> None:
+        raise DummyException()
+
+    stat = os.stat(path)
+    with pytest.raises(DummyException):
+        migrations.upgrade_rebuild(path, connect)
+    assert os.stat(path).st_ino == stat.st_ino
+    assert not os.path.exists(f"{path}-dbver-rebuild")
+    conn = connect(path)
+    try:
+        assert migrations.get_format(conn) == 1000000
+        assert select_all(conn, "pragma journal_mode") == [(journal_mode,)]
+    finally:
+        conn.close()
+
+
+def test_exclusive(path: str, connect: Callable[[str], dbver.Connection]) -> None:
+    migrations = dbver.SemverMigrations[dbver.Connection](application_id=1)
+    migrations.add(0, 1000000, migrate_1)
+    other = connect(path)
+    other.cursor().execute("pragma busy_timeout = 0")
+
+    @migrations.migrates(1000000, 1001000)
+    def check_locked(conn: dbver.Connection, schema: str) -> None:
+        with pytest.raises(dbver.Errors):
+            other.cursor().execute("select * from a").fetchone()
+
+    try:
+        assert migrations.upgrade_rebuild(path, connect) == 1001000
+    finally:
+        other.close()
@@ -0,0 +1,153 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import os
+import pathlib
+from typing import Callable
+from typing import Iterator
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.UserVersionMigrations[dbver.Connection]()
+
+
+@MIGRATIONS.migrates(0, 1)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    cur = conn.cursor()
+    cur.execute(f'create table "{schema}".p (id integer primary key)')
+    cur.execute(f'create table "{schema}".c (p int references p (id))')
+    cur.execute(f'create index "{schema}".c_p on c (p)')
+
+
+@MIGRATIONS.migrates(1, 2)
+def migrate_2(conn: dbver.Connection, schema: str) -> None:
+    # foreign keys aren't enforced by default
+    conn.cursor().execute(f'insert into "{schema}".c (p) values (5)')
+
+
+@MIGRATIONS.migrates(2, 3)
+def migrate_3(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'delete from "{schema}".c')
+
+
+@pytest.fixture
+def pool(
+    tmp_path: pathlib.Path, threaded_connect: Callable[[str], dbver.Connection]
+) -> Iterator[dbver.ReusePool[dbver.Connection]]:
+    pool = dbver.ReusePool(functools.partial(threaded_connect, str(tmp_path / "db")))
+    yield pool
+    pool.close_all()
+
+
+def test_clean(pool: dbver.Pool[dbver.Connection]) -> None:
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        MIGRATIONS[0][1](conn, "main")
+    assert dbver.verify_integrity(pool) == []
+    assert dbver.verify_integrity(pool, full=True, max_workers=1) == []
+
+
+def test_empty(pool: dbver.Pool[dbver.Connection]) -> None:
+    assert dbver.verify_integrity(pool) == []
+
+
+def test_bounded_workers(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        for i in range(50):
+            conn.cursor().execute(f"create table t{i} (a int)")
+    assert dbver.verify_integrity(pool, max_workers=2) == []
+    assert pool.stats().creations <= 2
+    pool.close_all()
+    assert dbver.verify_integrity(pool) == []
+    # ThreadPoolExecutor's default
+    assert pool.stats().creations <= 2 + min(32, (os.cpu_count() or 1) + 4)
+
+
+def test_foreign_key_problem(pool: dbver.Pool[dbver.Connection]) -> None:
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        MIGRATIONS[0][1](conn, "main")
+        MIGRATIONS[1][2](conn, "main")
+    assert dbver.verify_integrity(pool) == [
+        dbver.IntegrityProblem(
+            "foreign_key_check", "c", "rowid 1 violates foreign key 0 to p"
+        )
+    ]
+    assert dbver.verify_integrity(pool, foreign_keys=False) == []
+
+
+def test_index_problem(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        cur = conn.cursor()
+        cur.execute("create table t (a int, b int)")
+        cur.execute("create index t_a on t (a)")
+        for i in range(3):
+            cur.execute("insert into t (a, b) values (?, ?)", (i, -i))
+        # make the index disagree with the table
+        cur.execute("pragma writable_schema = 1")
+        cur.execute(
+            "update sqlite_master set sql = 'create index t_a on t (b)' "
+            "where name = 't_a'"
+        )
+    pool.close_all()
+    problems = dbver.verify_integrity(pool, full=True)
+    assert problems
+    assert {(p.check, p.table) for p in problems} == {("integrity_check", "t")}
+
+
+def test_upgrade_verified(pool: dbver.Pool[dbver.Connection]) -> None:
+    with pytest.raises(dbver.IntegrityError) as exc_info:
+        MIGRATIONS.upgrade_verified(pool)
+    assert exc_info.value.from_format == 1
+    assert exc_info.value.to_format == 2
+    assert [p.table for p in exc_info.value.problems] == ["c"]
+    with dbver.begin_pool(pool, dbver.DEFERRED) as conn:
+        assert MIGRATIONS.get_format(conn) == 2
+    # existing problems are raised before any step
+    with pytest.raises(dbver.IntegrityError) as exc_info:
+        MIGRATIONS.upgrade_verified(pool, breaking=True)
+    assert exc_info.value.from_format is None
+    assert exc_info.value.to_format is None
+    assert [p.table for p in exc_info.value.problems] == ["c"]
+    with dbver.begin_pool(pool, dbver.DEFERRED) as conn:
+        assert MIGRATIONS.get_format(conn) == 2
+
+
+def test_upgrade_verified_noop(pool: dbver.Pool[dbver.Connection]) -> None:
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        MIGRATIONS[0][1](conn, "main")
+    assert MIGRATIONS.upgrade_verified(pool, condition=lambda orig, new: False) == 1
+
+
+def test_shards(
+    tmp_path: pathlib.Path, threaded_connect: Callable[[str], dbver.Connection]
+) -> None:
+    pools = [
+        dbver.ReusePool(functools.partial(threaded_connect, str(tmp_path / f"db{i}")))
+        for i in range(2)
+    ]
+    shards = dbver.Shards(pools, route=int)
+    try:
+        with dbver.begin_pool(pools[1], dbver.IMMEDIATE) as conn:
+            MIGRATIONS[0][1](conn, "main")
+            MIGRATIONS[1][2](conn, "main")
+        problems = shards.verify_integrity(max_workers=1)
+        assert [len(p) for p in problems] == [0, 1]
+        with pytest.raises(dbver.IntegrityError):
+            shards.upgrade(MIGRATIONS, breaking=True, verify=True, max_workers=1)
+        assert shards.get_formats(MIGRATIONS) == [2, 2]
+    finally:
+        for pool in pools:
+            pool.close_all()
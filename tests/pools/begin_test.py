@@ -50,3 +50,20 @@ def test_failure(conn: dbver.Connection, lock_mode: dbver.LockMode) -> None:
             raise DummyException()
     check_in_transaction(conn, False)
     assert conn.cursor().execute("SELECT * FROM x").fetchall() == []
+
+
+@pytest.mark.parametrize("lock_mode", LOCK_MODES)
+def test_commit_failure(conn: dbver.Connection, lock_mode: dbver.LockMode) -> None:
+    cur = conn.cursor()
+    cur.execute("PRAGMA foreign_keys = ON")
+    cur.execute("CREATE TABLE p (id INT PRIMARY KEY)")
+    cur.execute(
+        "CREATE TABLE c (p INT REFERENCES p (id) DEFERRABLE INITIALLY DEFERRED)"
+    )
+    # the violation is only checked at COMMIT, which fails and leaves the
+    # transaction open
+    with pytest.raises(dbver.Errors):
+        with dbver.begin(conn, lock_mode):
+            conn.cursor().execute("INSERT INTO c (p) VALUES (1)")
+    check_in_transaction(conn, False)
+    assert conn.cursor().execute("SELECT * FROM c").fetchall() == []
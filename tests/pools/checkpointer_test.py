@@ -0,0 +1,106 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import contextlib
+import functools
+import pathlib
+import time
+from typing import Callable
+from typing import Iterator
+from typing import List
+
+import pytest
+
+import dbver
+
+
+@pytest.fixture
+def path(tmp_path: pathlib.Path) -> pathlib.Path:
+    return tmp_path / "db"
+
+
+@pytest.fixture
+def pool(
+    path: pathlib.Path, threaded_connect: Callable[[str], dbver.Connection]
+) -> Iterator[dbver.ReusePool[dbver.Connection]]:
+    factory = dbver.pragma_factory(
+        functools.partial(threaded_connect, str(path)),
+        {"journal_mode": "wal", "wal_autocheckpoint": 0},
+    )
+    pool = dbver.ReusePool(factory)
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        conn.cursor().execute("create table a (a int primary key, t text)")
+    yield pool
+    pool.close_all()
+
+
+def write(pool: dbver.Pool[dbver.Connection], count: int = 100) -> None:
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        cur = conn.cursor()
+        for _ in range(count):
+            cur.execute("insert into a (t) values (hex(randomblob(100)))")
+
+
+def test_passive(path: pathlib.Path, pool: dbver.ReusePool[dbver.Connection]) -> None:
+    checkpointer = dbver.Checkpointer(pool)
+    write(pool)
+    checkpointer.run_once()
+    stats = checkpointer.stats()
+    assert stats.checkpoints == 1
+    assert stats.truncates == 0
+    assert stats.wal_bytes > 0
+    assert stats.total_duration >= stats.last_duration >= 0
+    assert (path.parent / "db-wal").stat().st_size > 0
+
+
+def test_truncate_bytes(
+    path: pathlib.Path, pool: dbver.ReusePool[dbver.Connection]
+) -> None:
+    used: List[None] = []
+
+    @contextlib.contextmanager
+    def writer() -> Iterator[None]:
+        used.append(None)
+        yield
+
+    checkpointer = dbver.Checkpointer(pool, truncate_bytes=1, writer=writer)
+    write(pool)
+    checkpointer.run_once()
+    assert checkpointer.stats().truncates == 1
+    assert len(used) == 1
+    assert (path.parent / "db-wal").stat().st_size == 0
+
+
+def test_truncate_interval(
+    path: pathlib.Path, pool: dbver.ReusePool[dbver.Connection]
+) -> None:
+    checkpointer = dbver.Checkpointer(pool, truncate_interval=0)
+    write(pool)
+    checkpointer.run_once()
+    assert checkpointer.stats().truncates == 1
+
+
+def test_background(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    checkpointer = dbver.Checkpointer(pool, interval=0.01, truncate_bytes=1)
+    checkpointer.start()
+    try:
+        with pytest.raises(AssertionError):
+            checkpointer.start()
+        write(pool)
+        deadline = time.monotonic() + 5
+        while checkpointer.stats().truncates == 0:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        checkpointer.stop()
@@ -0,0 +1,87 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import os
+import pathlib
+from typing import Callable
+
+import pytest
+
+import dbver
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork()")
+
+
+def run_in_child(func: Callable[[], None]) -> int:
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        code = 1
+        try:
+            func()
+            code = 0
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status)
+    return os.WEXITSTATUS(status)
+
+
+@pytest.fixture
+def pool(
+    tmp_path: pathlib.Path, connect: Callable[[str], dbver.Connection]
+) -> dbver.ReusePool[dbver.Connection]:
+    return dbver.ReusePool(functools.partial(connect, str(tmp_path / "db")))
+
+
+def test_idle_not_reused(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    with pool() as parent_conn:
+        parent_conn.cursor().execute("create table a (a int)")
+
+    def child() -> None:  # pragma: no cover
+        assert pool.stats().idle == 0
+        with pool() as conn:
+            assert conn is not parent_conn
+            conn.cursor().execute("insert into a (a) values (1)")
+        assert pool.stats().creations == 1
+
+    assert run_in_child(child) == 0
+    with pool() as conn:
+        assert conn is parent_conn
+        cur = conn.cursor()
+        cur.execute("select * from a")
+        assert cur.fetchone() == (1,)
+
+
+def test_busy_not_returned(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    checkout = pool()
+    parent_conn = checkout.__enter__()
+
+    def child() -> None:  # pragma: no cover
+        checkout.__exit__(None, None, None)
+        assert pool.stats().idle == 0
+        with pool() as conn:
+            assert conn is not parent_conn
+
+    assert run_in_child(child) == 0
+    checkout.__exit__(None, None, None)
+    assert pool.stats().idle == 1
+    parent_conn.cursor().execute("select 1")
+
+
+def test_after_fork_noop(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    with pool():
+        pass
+    pool.after_fork()
+    assert pool.stats().idle == 1
@@ -0,0 +1,173 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import sqlite3
+import threading
+from typing import Callable
+from typing import List
+
+import pytest
+
+import dbver
+
+try:
+    import apsw
+except ImportError:
+    # https://github.com/python/mypy/issues/1153
+    apsw = None  # type: ignore
+
+
+@pytest.fixture
+def connect_uri(
+    connect: Callable[[str], dbver.Connection]
+) -> Callable[[str], dbver.Connection]:
+    if apsw is not None and connect is apsw.Connection:
+        return functools.partial(
+            apsw.Connection,
+            flags=apsw.SQLITE_OPEN_READWRITE
+            | apsw.SQLITE_OPEN_CREATE
+            | apsw.SQLITE_OPEN_URI,
+        )
+    return functools.partial(
+        sqlite3.connect, uri=True, isolation_level=None, check_same_thread=False
+    )
+
+
+def count(conn: dbver.Connection) -> int:
+    (value,) = conn.cursor().execute("select count(*) from t").fetchone()
+    return int(value)
+
+
+@pytest.mark.parametrize("shared_cache", (False, True))
+def test_shared(
+    connect_uri: Callable[[str], dbver.Connection], shared_cache: bool
+) -> None:
+    if (
+        shared_cache
+        and apsw is not None
+        and connect_uri.func is apsw.Connection  # type: ignore
+        and "OMIT_SHARED_CACHE" in apsw.compile_options
+    ):
+        pytest.skip("apsw built without shared cache")
+    uri = dbver.memory_uri(shared_cache=shared_cache)
+    pool = dbver.MemoryPool(functools.partial(connect_uri, uri))
+    try:
+        with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+            conn.cursor().execute("create table t (a int)")
+            conn.cursor().execute("insert into t (a) values (1)")
+        with pool() as conn1:
+            with pool() as conn2:
+                assert conn1 is not conn2
+                assert count(conn1) == count(conn2) == 1
+        # the anchor keeps the database while no pooled connections are open
+        pool.close_all()
+        assert pool.stats().idle == 0
+        with pool() as conn:
+            assert count(conn) == 1
+    finally:
+        pool.close()
+    other = connect_uri(uri)
+    try:
+        with pytest.raises(dbver.Errors):
+            count(other)
+    finally:
+        other.close()
+
+
+def test_names_isolated(connect_uri: Callable[[str], dbver.Connection]) -> None:
+    uri1 = dbver.memory_uri()
+    uri2 = dbver.memory_uri()
+    assert uri1 != uri2
+    pool1 = dbver.MemoryPool(functools.partial(connect_uri, uri1))
+    pool2 = dbver.MemoryPool(functools.partial(connect_uri, uri2))
+    try:
+        with pool1() as conn:
+            conn.cursor().execute("create table t (a int)")
+        with pool2() as conn:
+            assert not dbver.has_tables(conn)
+    finally:
+        pool1.close()
+        pool2.close()
+
+
+def test_quoted_name(connect_uri: Callable[[str], dbver.Connection]) -> None:
+    uri = dbver.memory_uri("name with ?&#% chars")
+    assert "?" not in uri.split("?")[0][5:]
+    pool = dbver.MemoryPool(functools.partial(connect_uri, uri))
+    try:
+        with pool() as conn:
+            conn.cursor().execute("create table t (a int)")
+        with pool() as conn1, pool() as conn2:
+            assert conn1 is not conn2
+            assert dbver.has_tables(conn2)
+    finally:
+        pool.close()
+
+
+def test_warmup_prefill(connect_uri: Callable[[str], dbver.Connection]) -> None:
+    warmed: List[dbver.Connection] = []
+    lock = threading.Lock()
+
+    def warmup(conn: dbver.Connection) -> None:
+        dbver.get_user_version(conn)
+        with lock:
+            warmed.append(conn)
+
+    uri = dbver.memory_uri()
+    pool = dbver.MemoryPool(
+        functools.partial(connect_uri, uri), warmup=warmup, prefill=2
+    )
+    try:
+        assert pool.ready.wait(5)
+        assert pool.stats().idle == 2
+        # the anchor isn't warmed up
+        assert len(warmed) == 2
+        with pool() as conn:
+            assert conn in warmed
+            conn.cursor().execute("create table t (a int)")
+        with pool() as conn1, pool() as conn2:
+            assert count(conn1) == count(conn2) == 0
+    finally:
+        pool.close()
+
+
+def write(pool: dbver.Pool[dbver.Connection]) -> None:
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        conn.cursor().execute("insert into t (a) values (1)")
+
+
+def test_concurrent_writers_wait(
+    connect_uri: Callable[[str], dbver.Connection]
+) -> None:
+    uri = dbver.memory_uri()
+    factory = dbver.pragma_factory(
+        functools.partial(connect_uri, uri), {"busy_timeout": 5000}
+    )
+    pool = dbver.MemoryPool(factory)
+    try:
+        with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+            conn.cursor().execute("create table t (a int)")
+        with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+            conn.cursor().execute("insert into t (a) values (1)")
+            # another connection waits on the write lock, instead of failing
+            thread = threading.Thread(target=write, args=(pool,))
+            thread.start()
+            thread.join(0.1)
+            assert thread.is_alive()
+        thread.join()
+        with pool() as conn:
+            assert count(conn) == 2
+    finally:
+        pool.close()
@@ -0,0 +1,109 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import pathlib
+from typing import Any
+from typing import Callable
+from typing import List
+
+import pytest
+
+import dbver
+
+
+def get_pragma(conn: dbver.Connection, name: str) -> Any:
+    cur = conn.cursor()
+    cur.execute(f"pragma {name}")
+    return cur.fetchone()[0]
+
+
+@pytest.fixture
+def factory(
+    tmp_path: pathlib.Path, connect: Callable[[str], dbver.Connection]
+) -> Callable[[], dbver.Connection]:
+    return functools.partial(connect, str(tmp_path / "db"))
+
+
+def test_apply(factory: Callable[[], dbver.Connection]) -> None:
+    pragma_factory = dbver.pragma_factory(
+        factory,
+        {"journal_mode": "wal", "cache_size": -1234, "temp_store": "memory"},
+    )
+    conn = pragma_factory()
+    try:
+        assert get_pragma(conn, "journal_mode") == "wal"
+        assert get_pragma(conn, "cache_size") == -1234
+        assert get_pragma(conn, "temp_store") == 2
+        # no statement left active
+        with dbver.begin(conn, dbver.IMMEDIATE):
+            pass
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize(
+    "pragmas",
+    (
+        dbver.READ_HEAVY_PRAGMAS,
+        dbver.WRITE_HEAVY_PRAGMAS,
+        dbver.BULK_LOAD_PRAGMAS,
+    ),
+)
+def test_presets(
+    factory: Callable[[], dbver.Connection], pragmas: dbver.Pragmas
+) -> None:
+    conn = dbver.pragma_factory(factory, pragmas)()
+    try:
+        assert get_pragma(conn, "cache_size") == pragmas["cache_size"]
+        assert get_pragma(conn, "busy_timeout") == pragmas["busy_timeout"]
+    finally:
+        conn.close()
+
+
+def test_once_per_connection(factory: Callable[[], dbver.Connection]) -> None:
+    calls: List[None] = []
+
+    def counting_factory() -> dbver.Connection:
+        calls.append(None)
+        return factory()
+
+    pool = dbver.ReusePool(dbver.pragma_factory(counting_factory, {"cache_size": -5}))
+    for _ in range(3):
+        with pool() as conn:
+            assert get_pragma(conn, "cache_size") == -5
+    assert len(calls) == 1
+    pool.close_all()
+
+
+def test_schema(conn: dbver.Connection) -> None:
+    conn.cursor().execute("attach ':memory:' as ?", ("other schema",))
+    dbver.apply_pragmas(conn, {"cache_size": -77}, schema="other schema")
+    assert get_pragma(conn, '"other schema".cache_size') == -77
+    assert get_pragma(conn, "main.cache_size") != -77
+
+
+@pytest.mark.parametrize(
+    "pragmas",
+    (
+        {"cache_size; drop table x": 1},
+        {"journal_mode": "wal; drop table x"},
+        {"cache_size": 1.5},
+    ),
+)
+def test_invalid(
+    factory: Callable[[], dbver.Connection], pragmas: dbver.Pragmas
+) -> None:
+    with pytest.raises(ValueError):
+        dbver.pragma_factory(factory, pragmas)
@@ -0,0 +1,178 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import logging
+import pathlib
+import sqlite3
+import threading
+from typing import Callable
+from typing import List
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.UserVersionMigrations[dbver.Connection](application_id=1)
+
+
+@MIGRATIONS.migrates(0, 1)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    cur = conn.cursor()
+    cur.execute(f'create table "{schema}".a (a int primary key, b text)')
+    cur.execute(f'create index "{schema}".a_b on a (b)')
+    cur.execute(f"insert into \"{schema}\".a (a, b) values (1, 'x')")
+
+
+class DummyException(Exception):
+    pass
+
+
+@pytest.fixture
+def factory(
+    tmp_path: pathlib.Path, threaded_connect: Callable[[str], dbver.Connection]
+) -> Callable[[], dbver.Connection]:
+    factory = functools.partial(threaded_connect, str(tmp_path / "db"))
+    conn = factory()
+    try:
+        with dbver.begin(conn, dbver.IMMEDIATE):
+            MIGRATIONS.upgrade(conn)
+    finally:
+        conn.close()
+    return factory
+
+
+def test_prefill(factory: Callable[[], dbver.Connection]) -> None:
+    warmed: List[dbver.Connection] = []
+    pool = dbver.ReusePool(factory, warmup=warmed.append, prefill=3)
+    try:
+        assert pool.ready.wait(5)
+        assert len(warmed) == 3
+        stats = pool.stats()
+        assert stats.idle == 3
+        assert stats.busy == 0
+        assert stats.creations == 3
+        with pool() as conn:
+            assert conn in warmed
+        assert pool.stats().creations == 3
+    finally:
+        pool.close_all()
+
+
+def test_no_prefill(factory: Callable[[], dbver.Connection]) -> None:
+    pool = dbver.ReusePool(factory)
+    assert pool.ready.is_set()
+    assert pool.stats().idle == 0
+
+
+def test_prefill_max_size(factory: Callable[[], dbver.Connection]) -> None:
+    pool = dbver.ReusePool(factory, max_size=2, prefill=5)
+    try:
+        assert pool.ready.wait(5)
+        assert pool.stats().idle == 2
+        assert pool.prefill(1).wait(5)
+        assert pool.stats().idle == 2
+    finally:
+        pool.close_all()
+
+
+def test_prefill_failure(factory: Callable[[], dbver.Connection]) -> None:
+    calls: List[int] = []
+    lock = threading.Lock()
+
+    def flaky(conn: dbver.Connection) -> None:
+        with lock:
+            calls.append(1)
+            if len(calls) == 1:
+                raise DummyException()
+
+    pool = dbver.ReusePool(factory, max_size=2, warmup=flaky, prefill=2)
+    try:
+        assert pool.ready.wait(5)
+        stats = pool.stats()
+        assert stats.idle == 1
+        assert stats.busy == 0
+        # the failed slot is available again
+        with pool(), pool():
+            pass
+    finally:
+        pool.close_all()
+
+
+def test_prefill_thread_bound(
+    tmp_path: pathlib.Path, caplog: pytest.LogCaptureFixture
+) -> None:
+    factory = functools.partial(sqlite3.connect, str(tmp_path / "db"))
+    with caplog.at_level(logging.ERROR, logger="dbver"):
+        pool = dbver.ReusePool(factory, max_size=2, prefill=2)
+        try:
+            assert pool.ready.wait(5)
+            stats = pool.stats()
+            assert stats.idle == 0
+            assert stats.busy == 0
+            assert "check_same_thread=False" in caplog.text
+            # connections made on checkout are usable
+            with pool() as conn:
+                conn.cursor().execute("select 1")
+        finally:
+            pool.close_all()
+
+
+def test_warmup_failure_on_checkout(factory: Callable[[], dbver.Connection]) -> None:
+    def fail(conn: dbver.Connection) -> None:
+        raise DummyException()
+
+    pool = dbver.ReusePool(factory, warmup=fail)
+    with pytest.raises(DummyException):
+        with pool():
+            pass
+    assert pool.stats().busy == 0
+
+
+def test_warmup_hook(factory: Callable[[], dbver.Connection]) -> None:
+    hook = dbver.warmup(
+        pragmas={"cache_size": -1000},
+        migrations=MIGRATIONS,
+        tables=["a"],
+        indexes=["a_b"],
+    )
+    pool = dbver.ReusePool(factory, warmup=hook, prefill=1)
+    try:
+        assert pool.ready.wait(5)
+        with pool() as conn:
+            ((cache_size,),) = conn.cursor().execute("pragma cache_size").fetchall()
+            assert cache_size == -1000
+    finally:
+        pool.close_all()
+
+
+def test_warmup_hook_checks(factory: Callable[[], dbver.Connection]) -> None:
+    with pytest.raises(ValueError):
+        dbver.warmup(tables=['invalid"name'])
+    wrong = dbver.UserVersionMigrations[dbver.Connection](application_id=2)
+    conn = factory()
+    try:
+        with pytest.raises(dbver.VersionError):
+            dbver.warmup(migrations=wrong)(conn)
+    finally:
+        conn.close()
+
+
+def test_readonly_pool(factory: Callable[[], dbver.Connection]) -> None:
+    pool = dbver.readonly_pool(factory, warmup=dbver.warmup(tables=["a"]), prefill=2)
+    try:
+        assert pool.ready.wait(5)
+        assert pool.stats().idle == 2
+    finally:
+        pool.close_all()
@@ -0,0 +1,102 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import pathlib
+import sqlite3
+from typing import Callable
+
+import pytest
+
+import dbver
+
+try:
+    import apsw
+except ImportError:
+    # https://github.com/python/mypy/issues/1153
+    apsw = None  # type: ignore
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+
+@MIGRATIONS.migrates(0, 1000000)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    cur = conn.cursor()
+    cur.execute(f'create table "{schema}".a (a int primary key)')
+    cur.execute(f'insert into "{schema}".a (a) values (1)')
+
+
+@pytest.fixture
+def path(tmp_path: pathlib.Path, connect: Callable[[str], dbver.Connection]) -> str:
+    path = str(tmp_path / "db with spaces?")
+    conn = connect(path)
+    try:
+        MIGRATIONS.upgrade(conn)
+    finally:
+        conn.close()
+    return path
+
+
+@pytest.fixture
+def connect_uri(
+    connect: Callable[[str], dbver.Connection]
+) -> Callable[[str], dbver.Connection]:
+    if apsw is not None and connect is apsw.Connection:
+        return functools.partial(
+            apsw.Connection, flags=apsw.SQLITE_OPEN_READONLY | apsw.SQLITE_OPEN_URI
+        )
+    return functools.partial(
+        sqlite3.connect, uri=True, isolation_level=None, check_same_thread=False
+    )
+
+
+@pytest.mark.parametrize("immutable", (False, True))
+def test_read(
+    path: str, connect_uri: Callable[[str], dbver.Connection], immutable: bool
+) -> None:
+    uri = dbver.readonly_uri(path, immutable=immutable)
+    checks = []
+
+    def check(conn: dbver.Connection) -> None:
+        checks.append(MIGRATIONS.get_format(conn))
+
+    pool = dbver.readonly_pool(functools.partial(connect_uri, uri), check=check)
+    try:
+        with pool() as conn1:
+            with pool() as conn2:
+                for conn in (conn1, conn2):
+                    cur = conn.cursor()
+                    cur.execute("select * from a")
+                    assert cur.fetchone() == (1,)
+                    cur.execute("pragma mmap_size")
+                    assert cur.fetchone()[0] > 0
+                    with pytest.raises(dbver.Errors):
+                        conn.cursor().execute("insert into a (a) values (2)")
+        assert checks == [1000000]
+    finally:
+        pool.close_all()
+
+
+def test_check_failure(
+    path: str, connect_uri: Callable[[str], dbver.Connection]
+) -> None:
+    other = dbver.SemverMigrations[dbver.Connection](application_id=2)
+    uri = dbver.readonly_uri(path, immutable=True)
+    pool = dbver.readonly_pool(
+        functools.partial(connect_uri, uri), check=other.get_format
+    )
+    with pytest.raises(dbver.VersionError):
+        with pool():
+            pass  # pragma: no cover
+    assert pool.stats().idle == 0
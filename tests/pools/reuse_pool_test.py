@@ -0,0 +1,157 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import threading
+from typing import Callable
+from typing import List
+
+import pytest
+
+import dbver
+
+
+class DummyException(Exception):
+    pass
+
+
+class Tracker:
+    def __init__(self, conn_factory: Callable[[], dbver.Connection]) -> None:
+        self.conn_factory = conn_factory
+        self.created: List[dbver.Connection] = []
+
+    def __call__(self) -> dbver.Connection:
+        conn = self.conn_factory()
+        self.created.append(conn)
+        return conn
+
+
+def is_closed(conn: dbver.Connection) -> bool:
+    try:
+        conn.cursor().execute("select 1")
+    except dbver.Errors:
+        return True
+    return False
+
+
+@pytest.fixture
+def tracker(conn_factory: Callable[[], dbver.Connection]) -> Tracker:
+    return Tracker(conn_factory)
+
+
+def test_reuse(tracker: Tracker) -> None:
+    pool = dbver.ReusePool(tracker)
+    with pool() as conn1:
+        pass
+    with pool() as conn2:
+        with pool() as conn3:
+            pass
+    assert conn1 is conn2
+    assert conn3 is not conn1
+    assert len(tracker.created) == 2
+    stats = pool.stats()
+    assert (stats.checkouts, stats.creations, stats.idle, stats.busy) == (3, 2, 2, 0)
+    with pool():
+        assert pool.stats().busy == 1
+
+
+def test_reuse_after_failure(tracker: Tracker) -> None:
+    pool = dbver.ReusePool(tracker)
+    with pytest.raises(DummyException):
+        with pool():
+            raise DummyException()
+    with pool():
+        pass
+    assert len(tracker.created) == 1
+
+
+def test_factory_failure() -> None:
+    def factory() -> dbver.Connection:
+        raise DummyException()
+
+    pool = dbver.ReusePool(factory, max_size=1)
+    with pytest.raises(DummyException):
+        with pool():
+            pass  # pragma: no cover
+    assert pool.stats().busy == 0
+
+
+def test_idle_timeout(tracker: Tracker) -> None:
+    pool = dbver.ReusePool(tracker, idle_timeout=0)
+    with pool():
+        pass
+    assert pool.stats().idle == 0
+    assert is_closed(tracker.created[0])
+
+
+def test_idle_timeout_min_size(tracker: Tracker) -> None:
+    pool = dbver.ReusePool(tracker, idle_timeout=0, min_size=1)
+    with pool():
+        with pool():
+            pass
+    pool.evict()
+    assert pool.stats().idle == 1
+    # least recently used is evicted first
+    assert is_closed(tracker.created[1])
+    assert not is_closed(tracker.created[0])
+
+
+def test_max_lifetime(tracker: Tracker) -> None:
+    pool = dbver.ReusePool(tracker, max_lifetime=0, min_size=1)
+    with pool():
+        pass
+    assert pool.stats().idle == 0
+    assert is_closed(tracker.created[0])
+
+
+def test_close_all(tracker: Tracker) -> None:
+    pool = dbver.ReusePool(tracker)
+    with pool():
+        with pool():
+            pass
+        pool.close_all()
+        assert is_closed(tracker.created[1])
+        assert not is_closed(tracker.created[0])
+    assert is_closed(tracker.created[0])
+    assert pool.stats().idle == 0
+    with pool():
+        pass
+    assert len(tracker.created) == 3
+
+
+def test_max_size(tracker: Tracker) -> None:
+    pool = dbver.ReusePool(tracker, max_size=1)
+    checked_out = threading.Event()
+    done = threading.Event()
+
+    def other() -> None:
+        with pool():
+            checked_out.set()
+            done.wait()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    checked_out.wait()
+    threading.Timer(0.05, done.set).start()
+    with pool():
+        pass
+    thread.join()
+    stats = pool.stats()
+    assert stats.creations == 1
+    assert stats.waits == 1
+    assert stats.wait_time > 0
+
+
+def test_invalid_max_size(tracker: Tracker) -> None:
+    with pytest.raises(ValueError):
+        dbver.ReusePool(tracker, max_size=0)
@@ -0,0 +1,116 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import pathlib
+import sqlite3
+from typing import Callable
+from typing import Iterator
+from typing import List
+
+import pytest
+
+import dbver
+
+
+class DummyException(Exception):
+    pass
+
+
+@pytest.fixture
+def pool(
+    tmp_path: pathlib.Path, connect: Callable[[str], dbver.Connection]
+) -> Iterator[dbver.ReusePool[dbver.Connection]]:
+    factory = dbver.pragma_factory(
+        functools.partial(connect, str(tmp_path / "db")),
+        {"journal_mode": "wal", "busy_timeout": 0},
+    )
+    pool = dbver.ReusePool(factory)
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        conn.cursor().execute("create table a (a int primary key)")
+        conn.cursor().execute("insert into a (a) values (0)")
+        conn.cursor().execute("create table b (b int)")
+    yield pool
+    pool.close_all()
+
+
+def conflicting_body(
+    pool: dbver.Pool[dbver.Connection], conflicts: int, modes: List[bool]
+) -> Callable[[dbver.Connection], int]:
+    # Each call reads, then another connection writes, so upgrading our read
+    # snapshot to a write lock fails with SQLITE_BUSY_SNAPSHOT
+    def body(conn: dbver.Connection) -> int:
+        cur = conn.cursor()
+        cur.execute("select max(a) from a")
+        (value,) = cur.fetchone()
+        if len(modes) < conflicts:
+            with dbver.begin_pool(pool, dbver.IMMEDIATE) as other:
+                other.cursor().execute("insert into b (b) values (1)")
+        modes.append(True)
+        cur.execute("insert into a (a) values (?)", (value + 1,))
+        return int(value) + 1
+
+    return body
+
+
+def test_no_conflict(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    modes: List[bool] = []
+    body = conflicting_body(pool, 0, modes)
+    assert dbver.run_optimistic(pool, body) == 1
+    assert len(modes) == 1
+
+
+def test_retry(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    modes: List[bool] = []
+    body = conflicting_body(pool, 2, modes)
+    assert dbver.run_optimistic(pool, body, attempts=3) == 1
+    assert len(modes) == 3
+    with pool() as conn:
+        cur = conn.cursor()
+        cur.execute("select (select count(*) from a), (select count(*) from b)")
+        assert cur.fetchone() == (2, 2)
+
+
+def test_exhausted(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    modes: List[bool] = []
+    body = conflicting_body(pool, 2, modes)
+    with pytest.raises(dbver.Errors) as info:
+        dbver.run_optimistic(pool, body, attempts=2, fallback=False)
+    assert dbver.is_busy(info.value)
+    # the failed transaction was rolled back
+    with dbver.begin_pool(pool, dbver.IMMEDIATE):
+        pass
+
+
+def test_other_error(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    calls: List[None] = []
+
+    def body(conn: dbver.Connection) -> None:
+        calls.append(None)
+        raise DummyException()
+
+    with pytest.raises(DummyException):
+        dbver.run_optimistic(pool, body)
+    assert len(calls) == 1
+
+
+def test_is_busy() -> None:
+    assert dbver.is_busy(sqlite3.OperationalError("database is locked"))
+    assert not dbver.is_busy(sqlite3.OperationalError("no such table: x"))
+    assert not dbver.is_busy(DummyException())
+
+
+def test_invalid_attempts(pool: dbver.ReusePool[dbver.Connection]) -> None:
+    with pytest.raises(ValueError):
+        dbver.run_optimistic(pool, lambda conn: None, attempts=0)
@@ -0,0 +1,144 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import logging
+from typing import Iterator
+from typing import List
+
+import pytest
+
+import dbver
+
+
+@pytest.fixture
+def watchdog() -> Iterator[dbver.TransactionWatchdog]:
+    # runs only when the test calls run_once()
+    watchdog = dbver.TransactionWatchdog(0.0, interval=3600, stacks=True)
+    watchdog.start()
+    yield watchdog
+    watchdog.stop()
+
+
+def test_tracks_open(
+    conn: dbver.Connection, watchdog: dbver.TransactionWatchdog
+) -> None:
+    assert watchdog.open_transactions() == []
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        (record,) = watchdog.open_transactions()
+        assert record.conn is conn
+        assert record.lock_mode == dbver.IMMEDIATE
+        assert record.stack is not None
+        assert record.stack[-1].name == "test_tracks_open"
+    assert watchdog.open_transactions() == []
+
+
+def test_stack_limit(conn: dbver.Connection) -> None:
+    watchdog = dbver.TransactionWatchdog(0.0, interval=3600, stacks=True, stack_limit=3)
+
+    def nested(depth: int) -> None:
+        if depth:
+            nested(depth - 1)
+        else:
+            with dbver.begin(conn, dbver.DEFERRED):
+                (record,) = watchdog.open_transactions()
+                assert record.stack is not None
+                assert [frame.name for frame in record.stack] == ["nested"] * 3
+
+    watchdog.start()
+    try:
+        nested(20)
+    finally:
+        watchdog.stop()
+
+
+def test_no_stacks_by_default(conn: dbver.Connection) -> None:
+    watchdog = dbver.TransactionWatchdog(0.0, interval=3600)
+    watchdog.start()
+    try:
+        with dbver.begin(conn, dbver.DEFERRED):
+            (record,) = watchdog.open_transactions()
+            assert record.stack is None
+    finally:
+        watchdog.stop()
+
+
+def test_closed_on_failure(
+    conn: dbver.Connection, watchdog: dbver.TransactionWatchdog
+) -> None:
+    with pytest.raises(ZeroDivisionError):
+        with dbver.begin(conn, dbver.DEFERRED):
+            1 / 0
+    assert watchdog.open_transactions() == []
+
+
+def test_reports_once(
+    conn: dbver.Connection,
+    watchdog: dbver.TransactionWatchdog,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    assert watchdog.run_once() == []
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        with caplog.at_level(logging.WARNING, logger="dbver"):
+            (record,) = watchdog.run_once()
+        assert record.conn is conn
+        assert "immediate transaction open" in caplog.text
+        assert "test_reports_once" in caplog.text
+        assert watchdog.run_once() == []
+
+
+def test_callback(conn: dbver.Connection) -> None:
+    late: List[dbver.OpenTransaction] = []
+    watchdog = dbver.TransactionWatchdog(
+        0.0, interval=3600, callback=late.append, stacks=False
+    )
+    watchdog.start()
+    try:
+        with dbver.begin(conn, dbver.DEFERRED):
+            watchdog.run_once()
+    finally:
+        watchdog.stop()
+    assert [record.lock_mode for record in late] == [dbver.DEFERRED]
+    assert late[0].stack is None
+
+
+def test_interrupt(conn: dbver.Connection) -> None:
+    watchdog = dbver.TransactionWatchdog(0.05, interval=0.01, interrupt=True)
+    watchdog.start()
+    try:
+        with pytest.raises(dbver.Errors):
+            with dbver.begin(conn, dbver.DEFERRED):
+                conn.cursor().execute(
+                    "with recursive c(x) as (select 1 union all select x + 1 from c) "
+                    "select count(*) from c"
+                ).fetchall()
+    finally:
+        watchdog.stop()
+
+
+def test_one_at_a_time(watchdog: dbver.TransactionWatchdog) -> None:
+    other = dbver.TransactionWatchdog(1.0)
+    with pytest.raises(AssertionError):
+        other.start()
+    # stopping a watchdog that isn't started doesn't affect the started one
+    other.stop()
+    assert dbver._WATCHDOG is watchdog
+
+
+def test_stopped(conn: dbver.Connection) -> None:
+    watchdog = dbver.TransactionWatchdog(0.0, interval=3600)
+    watchdog.start()
+    watchdog.stop()
+    assert dbver._WATCHDOG is None
+    with dbver.begin(conn, dbver.IMMEDIATE):
+        assert watchdog.open_transactions() == []
@@ -0,0 +1,151 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import pathlib
+from typing import Callable
+from typing import Iterator
+
+import pytest
+
+import dbver
+
+
+@pytest.fixture
+def pool(
+    tmp_path: pathlib.Path, threaded_connect: Callable[[str], dbver.Connection]
+) -> Iterator[dbver.ReusePool[dbver.Connection]]:
+    factory = dbver.pragma_factory(
+        functools.partial(threaded_connect, str(tmp_path / "db")),
+        {"journal_mode": "wal", "busy_timeout": 5000},
+    )
+    pool = dbver.ReusePool(factory)
+    with dbver.begin_pool(pool, dbver.IMMEDIATE) as conn:
+        conn.cursor().execute("create table t (a int, b text, c blob)")
+    yield pool
+    pool.close_all()
+
+
+def count(pool: dbver.Pool[dbver.Connection]) -> int:
+    with dbver.begin_pool(pool, dbver.DEFERRED) as conn:
+        (value,) = conn.cursor().execute("select count(*) from t").fetchone()
+    return int(value)
+
+
+def record(
+    pool: dbver.Pool[dbver.Connection], path: pathlib.Path, values: bool
+) -> None:
+    with dbver.Recorder(pool, str(path), values=values) as recorder:
+        for i in range(3):
+            with recorder.begin(dbver.IMMEDIATE) as conn:
+                conn.cursor().execute(
+                    "insert into t (a, b, c) values (?, ?, ?)", (i, "x", b"\x00")
+                )
+                conn.cursor().executemany(
+                    "insert into t (a) values (:a)", [{"a": i}, {"a": None}]
+                )
+            with recorder.begin(dbver.DEFERRED) as conn:
+                conn.cursor().execute("select * from t").fetchall()
+
+
+def test_record_shapes(
+    pool: dbver.Pool[dbver.Connection], tmp_path: pathlib.Path
+) -> None:
+    path = tmp_path / "workload"
+    record(pool, path, values=False)
+    records = list(dbver.read_workload(str(path)))
+    assert [r.lock_mode for r in records] == [dbver.IMMEDIATE, dbver.DEFERRED] * 3
+    assert records[0].statements == [
+        ("insert into t (a, b, c) values (?, ?, ?)", ["int", "str", "bytes"], None),
+        ("insert into t (a) values (:a)", {"a": "int"}, None),
+        ("insert into t (a) values (:a)", {"a": "null"}, None),
+    ]
+    assert records[1].statements == [("select * from t", None, None)]
+    assert all(r.duration >= 0 and r.think >= 0 for r in records)
+    assert [r.start for r in records] == sorted(r.start for r in records)
+    # think time is the gap since the thread's previous transaction
+    assert records[0].think == 0
+    assert records[1].think <= records[1].start - records[0].start
+
+
+def test_replay_shapes(
+    pool: dbver.Pool[dbver.Connection], tmp_path: pathlib.Path
+) -> None:
+    path = tmp_path / "workload"
+    record(pool, path, values=False)
+    assert count(pool) == 9
+    stats = dbver.replay(pool, dbver.read_workload(str(path)), speed=None)
+    assert count(pool) == 18
+    assert set(stats) == {dbver.IMMEDIATE, dbver.DEFERRED}
+    for mode_stats in stats.values():
+        assert mode_stats.transactions == 3
+        assert mode_stats.errors == 0
+        assert mode_stats.throughput > 0
+        assert 0 <= mode_stats.p50 <= mode_stats.p95 <= mode_stats.p99
+    with dbver.begin_pool(pool, dbver.DEFERRED) as conn:
+        rows = conn.cursor().execute("select a, b, c from t where b = ''").fetchall()
+    assert [tuple(row) for row in rows] == [(0, "", b"")] * 3
+
+
+def test_replay_values(
+    pool: dbver.Pool[dbver.Connection], tmp_path: pathlib.Path
+) -> None:
+    path = tmp_path / "workload"
+    record(pool, path, values=True)
+    stats = dbver.replay(
+        pool, dbver.read_workload(str(path)), concurrency=4, speed=None
+    )
+    assert stats[dbver.IMMEDIATE].transactions == 3
+    with dbver.begin_pool(pool, dbver.DEFERRED) as conn:
+        rows = conn.cursor().execute("select a, b, c from t where b = 'x'").fetchall()
+    assert sorted(tuple(row) for row in rows) == [
+        (i, "x", b"\x00") for i in range(3) for _ in range(2)
+    ]
+
+
+def test_replay_errors(pool: dbver.Pool[dbver.Connection]) -> None:
+    records = [
+        dbver.TxRecord(
+            start=0.0,
+            lock_mode=dbver.IMMEDIATE,
+            duration=0.0,
+            think=0.0,
+            statements=[("insert into missing (a) values (1)", None, None)],
+        )
+    ]
+    stats = dbver.replay(pool, records)
+    assert stats[dbver.IMMEDIATE].errors == 1
+    assert stats[dbver.IMMEDIATE].transactions == 0
+
+
+def test_replay_speed(pool: dbver.Pool[dbver.Connection]) -> None:
+    records = [
+        dbver.TxRecord(
+            start=1.0,
+            lock_mode=dbver.DEFERRED,
+            duration=0.0,
+            think=0.0,
+            statements=[("select 1", None, None)],
+        )
+    ]
+    stats = dbver.replay(pool, records, speed=10.0)
+    # the transaction is held back until 0.1s into the replay
+    assert stats[dbver.DEFERRED].throughput < 1 / 0.1
+
+
+def test_invalid_arguments(pool: dbver.Pool[dbver.Connection]) -> None:
+    with pytest.raises(ValueError):
+        dbver.replay(pool, [], concurrency=0)
+    with pytest.raises(ValueError):
+        dbver.replay(pool, [], speed=0)
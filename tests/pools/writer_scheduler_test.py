@@ -0,0 +1,113 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import contextlib
+import threading
+import time
+from typing import ContextManager
+from typing import List
+
+import pytest
+
+import dbver
+
+
+class DummyException(Exception):
+    pass
+
+
+def wait_for(scheduler: dbver.WriterScheduler, waiting: int) -> None:
+    deadline = time.monotonic() + 5
+    while scheduler.waiting() != waiting:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_priority_order() -> None:
+    scheduler = dbver.WriterScheduler()
+    order: List[str] = []
+    threads = []
+
+    def writer(name: str, priority: int) -> None:
+        with scheduler.acquire(priority=priority):
+            order.append(name)
+
+    with scheduler.acquire():
+        for i, (name, priority) in enumerate(
+            (("low1", 0), ("high1", 10), ("low2", 0), ("high2", 10))
+        ):
+            thread = threading.Thread(target=writer, args=(name, priority))
+            thread.start()
+            threads.append(thread)
+            wait_for(scheduler, i + 1)
+    for thread in threads:
+        thread.join()
+    assert order == ["high1", "high2", "low1", "low2"]
+
+
+def test_exclusive() -> None:
+    scheduler = dbver.WriterScheduler()
+    active: List[None] = []
+    overlaps: List[None] = []
+
+    def writer() -> None:
+        for _ in range(50):
+            with scheduler.acquire():
+                active.append(None)
+                if len(active) > 1:
+                    overlaps.append(None)  # pragma: no cover
+                active.pop()
+
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not overlaps
+    assert scheduler.waiting() == 0
+
+
+def test_release_on_error() -> None:
+    scheduler = dbver.WriterScheduler()
+    with pytest.raises(DummyException):
+        with scheduler.acquire():
+            raise DummyException()
+    with scheduler.acquire():
+        pass
+
+
+def test_begin_pool(conn: dbver.Connection) -> None:
+    def pool() -> ContextManager[dbver.Connection]:
+        return contextlib.nullcontext(conn)
+
+    scheduler = dbver.WriterScheduler()
+    conn.cursor().execute("create table x (x int primary key)")
+
+    def other() -> None:
+        with scheduler.acquire():
+            pass
+
+    with scheduler.begin_pool(pool, dbver.IMMEDIATE, priority=1) as inner:
+        inner.cursor().execute("insert into x (x) values (1)")
+        # other writers wait
+        thread = threading.Thread(target=other)
+        thread.start()
+        wait_for(scheduler, 1)
+    thread.join()
+    # deferred transactions don't wait
+    with scheduler.acquire():
+        with scheduler.begin_pool(pool, dbver.DEFERRED) as inner:
+            cur = inner.cursor()
+            cur.execute("select * from x")
+            assert cur.fetchone() == (1,)
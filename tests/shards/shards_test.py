@@ -0,0 +1,134 @@
+# Copyright (c) 2022 AllSeeingEyeTolledEweSew
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+
+import functools
+import pathlib
+from typing import Callable
+from typing import Iterator
+
+import pytest
+
+import dbver
+
+MIGRATIONS = dbver.SemverMigrations[dbver.Connection](application_id=1)
+
+
+@MIGRATIONS.migrates(0, 1000000)
+def migrate_1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'create table "{schema}".a (a int primary key)')
+
+
+@MIGRATIONS.migrates(1000000, 1001000)
+def migrate_1dot1(conn: dbver.Connection, schema: str) -> None:
+    conn.cursor().execute(f'alter table "{schema}".a add column t text')
+
+
+class DummyException(Exception):
+    pass
+
+
+@pytest.fixture
+def shards(
+    tmp_path: pathlib.Path, threaded_connect: Callable[[str], dbver.Connection]
+) -> Iterator[dbver.Shards[dbver.Connection]]:
+    pools = [
+        dbver.ReusePool(
+            functools.partial(threaded_connect, str(tmp_path / f"shard{i}"))
+        )
+        for i in range(4)
+    ]
+    yield dbver.Shards(pools, route=lambda key: key)
+    for pool in pools:
+        pool.close_all()
+
+
+def populate(shards: dbver.Shards[dbver.Connection]) -> None:
+    shards.upgrade(MIGRATIONS)
+    for i in range(100):
+        with dbver.begin_pool(shards.pool_for(i), dbver.IMMEDIATE) as conn:
+            conn.cursor().execute("insert into a (a, t) values (?, ?)", (i, str(i)))
+
+
+def test_upgrade(shards: dbver.Shards[dbver.Connection]) -> None:
+    assert shards.get_formats(MIGRATIONS) == [0, 0, 0, 0]
+    assert shards.upgrade(MIGRATIONS) == [1001000] * 4
+    shards.check(MIGRATIONS)
+    assert shards.get_formats(MIGRATIONS) == [1001000] * 4
+
+
+def test_check_failure(shards: dbver.Shards[dbver.Connection]) -> None:
+    with dbver.begin_pool(shards.pools[2], dbver.IMMEDIATE) as conn:
+        conn.cursor().execute("create table x (x int)")
+    with pytest.raises(dbver.VersionError):
+        shards.check(MIGRATIONS)
+    with pytest.raises(dbver.VersionError):
+        shards.upgrade(MIGRATIONS)
+    # other shards were still upgraded
+    with dbver.begin_pool(shards.pools[0], dbver.DEFERRED) as conn:
+        assert MIGRATIONS.get_format(conn) == 1001000
+
+
+def test_routing(shards: dbver.Shards[dbver.Connection]) -> None:
+    populate(shards)
+    assert len(shards) == 4
+    for i, pool in enumerate(shards.pools):
+        with pool() as conn:
+            cur = conn.cursor()
+            cur.execute("select count(*) from a where a % 4 != ?", (i,))
+            assert cur.fetchone() == (0,)
+
+
+def test_fan_out(shards: dbver.Shards[dbver.Connection]) -> None:
+    populate(shards)
+    rows = list(shards.fan_out("select a, t from a where a < ?", (50,), buffer=3))
+    assert sorted(rows) == [(i, str(i)) for i in range(50)]
+
+
+def test_fan_out_ordered(shards: dbver.Shards[dbver.Connection]) -> None:
+    populate(shards)
+    rows = shards.fan_out("select a from a order by a", key=lambda row: row[0])
+    assert list(rows) == [(i,) for i in range(100)]
+
+
+def test_fan_out_early_close(shards: dbver.Shards[dbver.Connection]) -> None:
+    populate(shards)
+    rows = shards.fan_out("select a from a", buffer=1)
+    next(rows)
+    rows.close()
+    # all connections were returned
+    for pool in shards.pools:
+        assert isinstance(pool, dbver.ReusePool)
+        assert pool.stats().busy == 0
+
+
+def test_fan_out_error(shards: dbver.Shards[dbver.Connection]) -> None:
+    with pytest.raises(dbver.Errors):
+        list(shards.fan_out("select * from no_such_table"))
+
+
+def test_map_error(shards: dbver.Shards[dbver.Connection]) -> None:
+    calls = []
+
+    def func(pool: dbver.Pool[dbver.Connection]) -> None:
+        calls.append(pool)
+        raise DummyException()
+
+    with pytest.raises(DummyException):
+        shards.map(func)
+    assert len(calls) == 4
+
+
+def test_no_shards() -> None:
+    with pytest.raises(ValueError):
+        dbver.Shards([], route=hash)